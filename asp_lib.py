@@ -0,0 +1,2614 @@
+##  asp_lib.py
+##
+##  /usr/bin/python2.7
+##
+
+import os
+import sys
+# import subprocess
+from subprocess import Popen, PIPE
+from subprocess import *
+import re
+import random
+import time
+import numpy as np
+import csv
+import gzip
+import json
+import hashlib
+import socket
+import sqlite3
+import tempfile
+import threading
+import functools
+import itertools
+import signal
+import multiprocessing
+from multiprocessing import util
+from multiprocessing.pool import ThreadPool
+from collections import OrderedDict
+try:
+    import Queue as queue
+except ImportError:
+    import queue
+try:
+    from StringIO import StringIO
+except ImportError:
+    from io import StringIO
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+
+# command used to start the solver; pool workers may replace this
+# with a client for a resident JVM (see SolverPool)
+SPARC_CMD = ['java', '-jar', 'sparc.jar']
+# back-end solver for programs already translated by sparc
+CLINGO_CMD = ['clingo']
+# rendered programs are handed to the solver through this directory
+PROGRAM_TMP = '/dev/shm' if os.path.isdir('/dev/shm') else tempfile.gettempdir()
+
+
+# --------------------------------------------------------------------------------- #
+#                                  Helper Functions
+# --------------------------------------------------------------------------------- #
+
+class MetricsLog:
+    """Appends the timings of solver calls to a tab separated file."""
+    FIELDS = ['program', 'args', 'wall', 'start', 'translate', 'solve',
+              'user', 'sys', 'max_rss', 'outcome']
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.lock = threading.Lock()
+        if not os.path.exists(filename):
+            with open(filename, 'w') as f:
+                f.write('\t'.join(self.FIELDS) + '\n')
+
+    def add(self, stats):
+        row = '\t'.join([str(stats.get(k, '')) for k in self.FIELDS]) + '\n'
+        with self.lock:
+            with open(self.filename, 'a') as f:
+                f.write(row)
+
+
+# set to a MetricsLog to record every solver call
+solver_log = None
+# wall time (s) and address space (MB) limits of each solver process
+# and of the processes it starts, e.g. clingo (None: no limit)
+solver_timeout = None
+solver_max_mem = None
+# solver messages on running out of memory: the JVM, clingo (C++)
+# and the C library under the address space limit
+MEMOUT_MESSAGES = ['OutOfMemoryError', 'bad_alloc', 'Cannot allocate memory',
+                   'insufficient memory', 'MemoryError']
+
+
+def is_memout(line):
+    return any(m in line for m in MEMOUT_MESSAGES)
+
+
+class SolverTimeout(Exception):
+    """A solver call was stopped: kind is 'timeout' (killed after
+    solver_timeout) or 'memout' (sparc or clingo ran out of
+    solver_max_mem); stats
+    are the timings of the call up to then."""
+    def __init__(self, kind, stats):
+        Exception.__init__(self, kind, stats)
+        self.kind = kind
+        self.stats = stats
+
+
+# solver processes get a process group of their own (see kill_solver),
+# with no python code run in the child between fork and exec (unsafe
+# with threads): start_new_session on python 3, the setsid command on 2
+if sys.version_info[0] >= 3:
+    SESSION_ARGS, SESSION_CMD = {'start_new_session': True}, []
+else:
+    from distutils.spawn import find_executable
+    SESSION_ARGS, SESSION_CMD = {}, (['setsid'] if find_executable('setsid') else [])
+
+
+def solver_popen(args, **kwargs):
+    """Starts a sparc process in its own process group. With
+    solver_max_mem, the address space of sparc and of the clingo
+    process it starts are each limited by 'ulimit -v' in a shell
+    that then execs sparc, which the children inherit. The JVM
+    gets half of it as heap (-Xmx), and smaller reservations for
+    classes and compiled code than its defaults, so that it starts
+    within the limit."""
+    cmd = list(SPARC_CMD)
+    if solver_max_mem:
+        if os.path.basename(cmd[0]) == 'java':
+            cmd[1:1] = ['-Xmx%dm' % (solver_max_mem // 2), '-XX:CompressedClassSpaceSize=64m',
+                        '-XX:ReservedCodeCacheSize=64m']
+        cmd = ['sh', '-c', 'ulimit -v %d && exec "$@"' % (solver_max_mem * 1024), 'sh'] + cmd
+    kwargs.update(SESSION_ARGS)
+    return Popen(SESSION_CMD + cmd + list(args), universal_newlines=True, **kwargs)
+
+
+def kill_solver(process):
+    """Kills a solver process started by solver_popen and its children."""
+    try:
+        os.killpg(process.pid, signal.SIGKILL)
+    except OSError:
+        # no process group of its own (python 2 without setsid)
+        try:
+            process.kill()
+        except OSError:
+            pass
+# timings of the last solver call made by the current thread
+_call_stats = threading.local()
+
+
+def last_call_stats():
+    """Returns the timings of the last solver call made by this thread,
+    or None (e.g. if the call was answered from a cache)."""
+    return getattr(_call_stats, 'last', None)
+
+
+def timed_jarwrapper(*args):
+    """Like jarwrapper, but also returns the timings of the call:
+    wall time, time to start the process, translation time (until
+    sparc reports the program translated), grounding/solving time,
+    child user/sys CPU time (rusage) and peak RSS in kB.
+    Raises SolverTimeout if the call is stopped by the limits
+    solver_timeout or solver_max_mem."""
+    t0 = time.time()
+    process = solver_popen(args, stdout=PIPE, stderr=PIPE)
+    t_started = time.time()
+    timed_out = threading.Event()
+    timer = None
+    if solver_timeout:
+        def stop():
+            timed_out.set()
+            kill_solver(process)
+        timer = threading.Timer(solver_timeout, stop)
+        timer.start()
+    t_translated = None
+    ret = []
+    try:
+        for line in iter(process.stdout.readline, ''):
+            if t_translated is None and 'program translated' in line:
+                t_translated = time.time()
+            ret.append(line.rstrip('\n'))
+        stderr = process.stderr.read()
+    except BaseException:
+        # e.g. KeyboardInterrupt: don't leave the solver running
+        kill_solver(process)
+        process.wait()
+        raise
+    finally:
+        if timer:
+            timer.cancel()
+    # reap the child ourselves to get its resource usage
+    pid, status, usage = os.wait4(process.pid, 0)
+    process.returncode = -os.WTERMSIG(status) if os.WIFSIGNALED(status) else os.WEXITSTATUS(status)
+    t_end = time.time()
+    if stderr != '':
+        ret += stderr.split('\n')
+        # runtime_error = True # uncomment & return to use error msg.
+    if '' in ret:
+        ret.remove('')
+    t_solving = t_translated or t_started
+    stats = {'program': args[0] if args else '',
+             'args': ' '.join([a.strip() for a in args[1:]]),
+             'wall': t_end - t0,
+             'start': t_started - t0,
+             'translate': (t_translated - t_started) if t_translated else 0.0,
+             'solve': t_end - t_solving,
+             'user': usage.ru_utime,
+             'sys': usage.ru_stime,
+             'max_rss': usage.ru_maxrss,
+             'returncode': process.returncode,
+             'outcome': 'ok'}
+    if timed_out.is_set():
+        stats['outcome'] = 'timeout'
+    elif any(is_memout(l) for l in ret):
+        stats['outcome'] = 'memout'
+    _call_stats.last = stats
+    if solver_log is not None:
+        solver_log.add(stats)
+    if stats['outcome'] != 'ok':
+        raise SolverTimeout(stats['outcome'], stats)
+    return ret, stats
+
+
+def jarwrapper(*args):
+    """Runs the solver, taking in the regular sparc
+     input arguments, and returns the output of the
+     solver. The call goes to the current solver
+     backend (see set_backend), by default a sparc
+     process; its timings are then available from
+     last_call_stats()."""
+    return solver_backend.solve(*args)
+
+
+def stream_answer_sets(*args, **limits):
+    """Starts a sparc solver process and yields its answer sets,
+    parsed as in out_to_list, as they are printed. The solver
+    is killed once one of the optional limits is reached:
+    max_sets (number of answer sets), max_bytes (output size)
+    or max_time (seconds, solver_timeout by default). Raises
+    SolverTimeout if the solver is stopped by max_time or runs out
+    of memory before any answer set."""
+    max_sets = limits.get('max_sets')
+    max_bytes = limits.get('max_bytes')
+    max_time = limits.get('max_time', solver_timeout)
+    process = solver_popen(args, stdout=PIPE, stderr=STDOUT)
+    timed_out = threading.Event()
+    timer = None
+    if max_time:
+        def stop():
+            timed_out.set()
+            kill_solver(process)
+        timer = threading.Timer(max_time, stop)
+        timer.start()
+    n_sets = 0
+    n_bytes = 0
+    memout = False
+    try:
+        for line in iter(process.stdout.readline, ''):
+            n_bytes += len(line)
+            line = line.strip()
+            memout = memout or is_memout(line)
+            # header and error lines are skipped
+            if line.startswith('{'):
+                yield line[1:-1].split(', ')
+                n_sets += 1
+                if max_sets and n_sets >= max_sets:
+                    break
+            if max_bytes and n_bytes >= max_bytes:
+                break
+    finally:
+        if timer:
+            timer.cancel()
+        if process.poll() is None:
+            kill_solver(process)
+        process.stdout.close()
+        process.wait()
+    if not n_sets and (timed_out.is_set() or memout):
+        raise SolverTimeout('timeout' if timed_out.is_set() else 'memout', {})
+
+
+def jarwrapper_limited(*args, **limits):
+    """Like jarwrapper, but stops the solver early,
+    see stream_answer_sets for the limits."""
+    return ['{' + ', '.join(a) + '}' for a in stream_answer_sets(*args, **limits)]
+
+
+def rm_header(result):
+    """Removes the header from program output"""
+    o = filter(None, result)
+    o = [x for x in o if "SPARC" not in x]
+    o = [x for x in o if "program translated" not in x]
+    return o
+
+
+# TODO
+# create a method to detect and deal with runtime errors
+
+
+def _free_port():
+    """A TCP port on localhost that is free at the time of the call."""
+    sock = socket.socket()
+    sock.bind(('127.0.0.1', 0))
+    port = sock.getsockname()[1]
+    sock.close()
+    return port
+
+
+def _wait_for_port(port, server, timeout):
+    """Waits until the server process accepts connections on port."""
+    deadline = time.time() + timeout
+    while True:
+        try:
+            socket.create_connection(('127.0.0.1', port), 1).close()
+            return
+        except socket.error:
+            if server.poll() is not None:
+                raise RuntimeError('solver server exited with status %d' % server.returncode)
+            if time.time() > deadline:
+                raise RuntimeError('solver server not listening on port %d' % port)
+            time.sleep(0.1)
+
+
+def _stop_server(server):
+    if server.poll() is None:
+        server.kill()
+
+
+def _init_pool_worker(client_cmd, server_cmd, ready_timeout):
+    """Runs once in every new pool worker. If a server command
+    is given, a resident solver JVM is started for the lifetime
+    of the worker and calls go through the client command.
+    '{port}' and '{worker}' in either command are replaced by a
+    free port and the worker number; with '{port}', the worker
+    waits until the server listens there."""
+    global SPARC_CMD, _server_error
+    identity = multiprocessing.current_process()._identity
+    fields = {'worker': identity[-1] if identity else 0, 'port': _free_port()}
+    if client_cmd:
+        SPARC_CMD = [a.format(**fields) for a in client_cmd]
+    if server_cmd:
+        server = Popen([a.format(**fields) for a in server_cmd],
+                       stdout=open(os.devnull, 'w'), stderr=STDOUT)
+        # stop the server when the worker is recycled
+        util.Finalize(None, _stop_server, (server,), exitpriority=10)
+        if any('{port}' in a for a in server_cmd):
+            try:
+                _wait_for_port(fields['port'], server, ready_timeout)
+            except RuntimeError as e:
+                # raised by the calls: a failing initializer makes the
+                # pool start new workers forever
+                _server_error = e
+
+
+# workers always run the solver locally, even when the
+# module level jarwrapper has been replaced by a pool
+_local_jarwrapper = jarwrapper
+# set in a pool worker whose solver server did not start
+_server_error = None
+
+
+def _pool_job(args):
+    """Executes one solver call in a pool worker, returns
+    its output and timings."""
+    if _server_error is not None:
+        raise _server_error
+    out = _local_jarwrapper(*args)
+    return out, last_call_stats()
+
+
+class SolverPool:
+    """A pool of long-lived solver workers. Programs and
+    arguments are sent to the workers over pipes, and each
+    worker is replaced after max_jobs calls.
+    jarwrapper() is a drop-in for the module level function;
+    the timings of the worker's call are available from
+    last_call_stats() as usual.
+    The pool gives parallel solver calls only: each call
+    still starts a JVM in the worker. server_cmd and client_cmd
+    are hooks for a resident solver per worker, called through
+    a client command in place of SPARC_CMD; '{port}' in both
+    gives each worker's server its own port (see
+    _init_pool_worker), and workers wait up to ready_timeout
+    seconds for their server to listen. No such server is set
+    up for sparc here. """
+    def __init__(self, size=None, max_jobs=100, client_cmd=None, server_cmd=None,
+                 ready_timeout=60):
+        self.size = size or multiprocessing.cpu_count()
+        self.max_jobs = max_jobs
+        self.pool = multiprocessing.Pool(self.size, _init_pool_worker,
+                                         (client_cmd, server_cmd, ready_timeout), max_jobs)
+
+    def jarwrapper(self, *args):
+        """Same as jarwrapper(*args), executed by a pool worker."""
+        out, _call_stats.last = self.pool.apply(_pool_job, (args,))
+        return out
+
+    def map(self, arg_list):
+        """Runs a list of argument tuples, returns outputs in order."""
+        return [out for out, stats in self.pool.map(_pool_job, [tuple(a) for a in arg_list])]
+
+    def close(self):
+        self.pool.close()
+        self.pool.join()
+
+
+def evict_lru(cache_dir, suffix, max_bytes):
+    """Deletes the least recently used files (by mtime) with
+    the given suffix until the directory is under max_bytes."""
+    # other threads or processes may remove files meanwhile
+    files = []
+    for f in os.listdir(cache_dir):
+        if f.endswith(suffix):
+            try:
+                st = os.stat(os.path.join(cache_dir, f))
+            except OSError:
+                continue
+            files.append((st.st_mtime, st.st_size, os.path.join(cache_dir, f)))
+    files.sort()
+    total = sum(size for mtime, size, f in files)
+    while files and total > max_bytes:
+        mtime, size, oldest = files.pop(0)
+        total -= size
+        try:
+            os.remove(oldest)
+        except OSError:
+            pass
+
+
+def _cache_tmp(cache_dir):
+    """A new temporary file in cache_dir, to be renamed into place."""
+    fd, tmp = tempfile.mkstemp(suffix='.tmp', dir=cache_dir)
+    os.close(fd)
+    return tmp
+
+
+def solver_version():
+    """Identifies the installed sparc translator by the size
+    and modification time of the jar file."""
+    jar = [a for a in SPARC_CMD if a.endswith('.jar')]
+    if not jar or not os.path.exists(jar[0]):
+        return ' '.join(SPARC_CMD)
+    st = os.stat(jar[0])
+    return '%s:%d:%d' % (jar[0], st.st_size, int(st.st_mtime))
+
+
+def display_filter(program_text):
+    """Returns the predicates listed in the display section
+    of a sparc program, e.g. ['success', 'occurs', '-holds']."""
+    lines = program_text.split('\n')
+    disp = find_line_id('display', [l.strip() for l in lines])
+    if not disp:
+        return None
+    preds = []
+    for line in lines[disp[-1] + 1:]:
+        line = line.split('%')[0].strip()
+        if line:
+            preds.append(line.rstrip('.').strip())
+    return preds
+
+
+def _n_models(args):
+    """Converts sparc arguments to the number of models for clingo."""
+    args = [a.strip() for a in args]
+    if '-n' in args:
+        return int(args[args.index('-n') + 1])
+    return 0 if '-A' in args else 1
+
+
+def _optimal_models(models):
+    """Keeps the models of least cost from a list of (cost, atoms)
+    pairs, without repeats. Programs with cr-rules are optimization
+    problems for clingo and only their optimal models are answer
+    sets; for other programs all costs are empty and all are kept."""
+    if not models:
+        return []
+    best = min(cost for cost, atoms in models)
+    seen = set()
+    ret = []
+    for cost, atoms in models:
+        key = tuple(sorted(str(a) for a in atoms))
+        if cost == best and key not in seen:
+            seen.add(key)
+            ret.append(atoms)
+    return ret
+
+
+def _model_atoms(model, shown):
+    """Atoms of a clingo model, restricted to the displayed predicates."""
+    atoms = []
+    for sym in model.symbols(atoms=True):
+        name = ('-' if sym.negative else '') + sym.name
+        if shown is None or name in shown:
+            atoms.append(parse_atom(str(sym)))
+    return atoms
+
+
+class TranslationCache:
+    """On-disk cache of translated sparc programs, keyed by
+    a hash of the program text and the translator version.
+    Files are evicted least recently used first once the
+    cache grows over max_bytes."""
+    def __init__(self, cache_dir='sparc_cache', max_bytes=200 * 2**20):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.version = solver_version()
+        self.hits = 0
+        self.misses = 0
+        if not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir)
+
+    def path(self, text):
+        key = hashlib.sha1((self.version + '\n' + text).encode('utf-8')).hexdigest()
+        return os.path.join(self.cache_dir, key + '.lp')
+
+    def translate(self, prog_file):
+        """Returns the path of the translated program,
+        running the translator only on a cache miss."""
+        with open(prog_file) as f:
+            text = f.read()
+        out = self.path(text)
+        if os.path.exists(out):
+            try:
+                os.utime(out, None)  # mark as recently used
+                self.hits += 1
+                return out
+            except OSError:
+                pass  # evicted meanwhile
+        self.misses += 1
+        tmp = _cache_tmp(self.cache_dir)
+        try:
+            ret, stats = timed_jarwrapper(prog_file, '-o', tmp)
+            # a failed translation must not be cached
+            if stats['returncode'] != 0 or not os.path.getsize(tmp):
+                raise RuntimeError('sparc could not translate %s (status %d) %s'
+                                   % (prog_file, stats['returncode'], ' '.join(ret[-3:])))
+            os.rename(tmp, out)
+        finally:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+        self.evict()
+        return out
+
+    def evict(self):
+        evict_lru(self.cache_dir, '.lp', self.max_bytes)
+
+    def jarwrapper(self, *args):
+        """Drop-in for jarwrapper(prog, *opts): the translation
+        comes from the cache and is solved directly by clingo.
+        Answer sets are returned in the sparc output format."""
+        prog_file = args[0]
+        lp = self.translate(prog_file)
+        with open(prog_file) as f:
+            shown = display_filter(f.read())
+        process = Popen(CLINGO_CMD + ['--outf=2', '--opt-mode=optN', lp,
+                                      str(_n_models(args[1:]))],
+                        stdout=PIPE, stderr=PIPE)
+        stdout, stderr = process.communicate()
+        result = json.loads(stdout)
+        models = []
+        for call in result.get('Call', []):
+            for witness in call.get('Witnesses', []):
+                atoms = [str(a) for a in witness['Value']]
+                if shown is not None:
+                    atoms = [a for a in atoms if a.split('(')[0] in shown]
+                models.append((witness.get('Costs', []), atoms))
+        return ['{' + ', '.join(atoms) + '}' for atoms in _optimal_models(models)]
+
+
+def normalize_program(text):
+    """Strips comments, blank lines and surrounding whitespace,
+    so that programs differing only in layout compare equal."""
+    lines = [l.split('%')[0].strip() for l in text.split('\n')]
+    return '\n'.join([l for l in lines if l])
+
+
+def solver_key(text, args):
+    """Hash of a normalized program and its solver arguments."""
+    norm = normalize_program(text) + '\n' + ' '.join([a.strip() for a in args])
+    return hashlib.sha1(norm.encode('utf-8')).hexdigest()
+
+
+class ResultCache:
+    """Memoizes solver output, keyed by the normalized program
+    text, the solver arguments, the sparc version and the solver
+    backend. Results are kept in an in-memory LRU of max_entries,
+    backed by pickles in cache_dir which are evicted LRU once
+    they exceed max_bytes (no disk tier if cache_dir is None).
+    solver is the function called on a miss, jarwrapper by default."""
+    def __init__(self, cache_dir='result_cache', max_entries=1000,
+                 max_bytes=500 * 2**20, solver=None):
+        self.cache_dir = cache_dir
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.solver = solver or _local_jarwrapper
+        self.memory = OrderedDict()
+        self.lock = threading.RLock()
+        self.mem_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        if cache_dir and not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir)
+
+    def key(self, text, args):
+        # outputs differ between sparc versions and solver backends
+        return solver_key(text, list(args) + [solver_version(), type(solver_backend).__name__])
+
+    def get(self, key):
+        with self.lock:
+            if key in self.memory:
+                self.mem_hits += 1
+                val = self.memory.pop(key)
+                self.memory[key] = val  # move to most recent
+                return val
+        if self.cache_dir:
+            path = os.path.join(self.cache_dir, key + '.pkl')
+            try:
+                with open(path, 'rb') as f:
+                    val = pickle.load(f)
+                os.utime(path, None)
+            except (IOError, OSError):
+                pass  # not cached, or evicted meanwhile
+            else:
+                self.disk_hits += 1
+                self.put(key, val, disk=False)
+                return val
+        self.misses += 1
+        return None
+
+    def put(self, key, val, disk=True):
+        with self.lock:
+            self.memory[key] = val
+            while len(self.memory) > self.max_entries:
+                self.memory.popitem(last=False)
+        if disk and self.cache_dir:
+            path = os.path.join(self.cache_dir, key + '.pkl')
+            tmp = _cache_tmp(self.cache_dir)
+            with open(tmp, 'wb') as f:
+                pickle.dump(val, f, pickle.HIGHEST_PROTOCOL)
+            os.rename(tmp, path)
+            evict_lru(self.cache_dir, '.pkl', self.max_bytes)
+
+    def jarwrapper(self, *args):
+        """Drop-in for jarwrapper(prog, *opts)."""
+        with open(args[0]) as f:
+            text = f.read()
+        key = self.key(text, args[1:])
+        val = self.get(key)
+        if val is None:
+            val = self.solver(*args)
+            self.put(key, val)
+        return list(val)
+
+    def stats(self):
+        return {'mem_hits': self.mem_hits, 'disk_hits': self.disk_hits,
+                'misses': self.misses, 'entries': len(self.memory)}
+
+
+class OutcomeCache(ResultCache):
+    """ResultCache for Experiment 2 rows. World-sim histories are
+    keyed by the initial state (as a set) and the occurs sequence
+    of the plan, diagnoses also by the knowledge variant (axiom
+    type and deleted axioms), so repeated plans are not solved
+    again. Keys include a digest of the program template, so
+    edits to world-sim.sp or diag-obs.sp invalidate them."""
+    def __init__(self, *args, **kwargs):
+        ResultCache.__init__(self, *args, **kwargs)
+        self.digests = {}
+
+    def program_digest(self, template):
+        """Hash of the normalized text of a ProgramTemplate,
+        computed once per template."""
+        digest = self.digests.get(id(template))
+        if digest is None:
+            norm = normalize_program(template.render())
+            digest = self.digests[id(template)] = hashlib.sha1(norm.encode('utf-8')).hexdigest()
+        return digest
+
+    def outcome_key(self, kind, init, plan, variant=None, template=None):
+        occ = [str(a) for a in plan if 'occurs' in a]
+        program = self.program_digest(template) if template is not None else None
+        content = [kind, program, sorted(set(map(str, init))), occ, variant]
+        return hashlib.sha1(json.dumps(content, default=str).encode('utf-8')).hexdigest()
+
+    def memo(self, key, func, *args):
+        """Returns the value cached under key, or func(*args)
+        which is then cached."""
+        val = self.get(key)
+        if val is None:
+            val = func(*args)
+            self.put(key, val)
+        return val
+
+
+class SolverBackend(object):
+    """Interface of the solvers behind jarwrapper: solve() takes
+    the sparc arguments (program file first) and returns the
+    output as a list of lines, answer sets as '{a, b, ...}'."""
+    def solve(self, *args):
+        raise NotImplementedError
+
+
+class SparcBackend(SolverBackend):
+    """Runs sparc.jar in a subprocess (SPARC_CMD)."""
+    def solve(self, *args):
+        return timed_jarwrapper(*args)[0]
+
+
+class ClingoBackend(SolverBackend):
+    """Solves in-process with the clingo python module. Programs
+    are translated by sparc once (through a TranslationCache)
+    and the models are read directly from clingo, with no
+    solver process or output parsing. answer_sets() returns
+    lists of Atoms, solve() sparc formatted lines."""
+    def __init__(self, translator=None):
+        import clingo
+        self.clingo = clingo
+        self.translator = translator or TranslationCache()
+
+    def answer_sets(self, *args):
+        prog_file = args[0]
+        lp = self.translator.translate(prog_file)
+        with open(prog_file) as f:
+            shown = display_filter(f.read())
+        ctl = self.clingo.Control([str(_n_models(args[1:])), '--opt-mode=optN'])
+        ctl.load(lp)
+        ctl.ground([('base', [])])
+        models = []
+        ctl.solve(on_model=lambda m: models.append((list(m.cost), _model_atoms(m, shown))))
+        return _optimal_models(models)
+
+    def solve(self, *args):
+        return ['{' + ', '.join([a.text for a in m]) + '}' for m in self.answer_sets(*args)]
+
+
+class ReplayBackend(SolverBackend):
+    """Replays recorded solver output, e.g. for tests. Recordings
+    are keyed like ResultCache (normalized program and arguments)
+    and kept in a json file. If a backend is given, calls missing
+    from the recording are solved by it and recorded."""
+    def __init__(self, filename, backend=None):
+        self.filename = filename
+        self.backend = backend
+        self.recordings = {}
+        if os.path.exists(filename):
+            with open(filename) as f:
+                self.recordings = json.load(f)
+
+    def solve(self, *args):
+        with open(args[0]) as f:
+            key = solver_key(f.read(), args[1:])
+        if key not in self.recordings:
+            if self.backend is None:
+                raise KeyError('no recorded solver output for %s %s' % (args[0], args[1:]))
+            self.recordings[key] = self.backend.solve(*args)
+            with open(self.filename, 'w') as f:
+                json.dump(self.recordings, f)
+        return [str(l) for l in self.recordings[key]]
+
+
+# backend used by jarwrapper
+solver_backend = SparcBackend()
+
+
+def set_backend(backend):
+    """Selects the solver backend used by jarwrapper,
+    run_goal_gen and the experiments."""
+    global solver_backend
+    solver_backend = backend
+
+
+def pick_goal(g):
+    """Set must be a list of possible goals in
+    the form of a literal"""
+    #g = random.choice(ans_set)
+    g = list(g)  # convert to list
+    g[-2] = 'I'  # insert chosen horizon value
+    goal_str = ''.join(g)  # create line to be inserted
+    return goal_str
+
+
+def find_line_id(string, f):
+    """Returns line number of a specific string (flag) to be searched for.
+    In this case, the flag is a line inserted before the specified goal in
+    ASP programs for this project."""
+    return [num for [num, line] in enumerate(f) if line.startswith(string)]
+
+
+# Marker comments delimiting the editable regions of the programs.
+# Regions are the lines between the start and end markers; the goal
+# region is the single line following its marker.
+PROGRAM_MARKERS = {
+    'goal': ('% Execution Goal', None),
+    'init': ('%&%& Received initial condition:', '%&%& End of starting state'),
+    'plan': ('%&%& Received plan:', '%&%& End of plan'),
+    'history': ('%&%& Received history:', '%&%& End of history'),
+    'ec': ('%&%& E.c.:', '%% AFFORDANCE AXIOMS END'),
+    'ar': ('%&%& A.R.:', '%&%& A.R. end'),
+}
+
+
+class ProgramTemplate:
+    """A sparc program parsed once, with the line ranges of
+    its marker regions indexed. Variants of the program are
+    rendered in memory by replacing regions, so the source
+    file is never re-read or modified."""
+    def __init__(self, filename=None, text=None):
+        if text is None:
+            with open(filename) as prog:
+                text = prog.read()
+        self.lines = text.splitlines(True)
+        self.regions = {}
+        for name, (start, end) in PROGRAM_MARKERS.items():
+            start_ln = find_line_id(start, self.lines)
+            if not start_ln:
+                continue
+            if end is None:
+                self.regions[name] = (start_ln[0] + 1, start_ln[0] + 2)
+            else:
+                end_ln = find_line_id(end, self.lines)
+                if end_ln:
+                    self.regions[name] = (start_ln[0] + 1, end_ln[0])
+        # planning horizon
+        const_ln = find_line_id('#const n=', self.lines)
+        if const_ln:
+            self.regions['horizon'] = (const_ln[0], const_ln[0] + 1)
+
+    def horizon(self):
+        """Returns the value of #const n in the program."""
+        return int(re.search(r"\d+", self.region_text('horizon')).group(0))
+
+    def region_text(self, name):
+        start, end = self.regions[name]
+        return ''.join(self.lines[start:end])
+
+    def render(self, goal=None, init=None, plan=None, history=None, ec=None, ar=None,
+               horizon=None):
+        """Returns the program text with the given regions replaced.
+        goal is a literal, init/plan/history are lists of literals
+        (only occurs are kept from a plan), ec/ar are raw text and
+        horizon is the new value of #const n. goal='' leaves the
+        program without a goal rule."""
+        new = {}
+        if horizon is not None:
+            new['horizon'] = ['#const n=%d.\n' % horizon]
+        if goal == '':
+            new['goal'] = ['\n']
+        elif goal is not None:
+            new['goal'] = ['goal(I):-' + str(goal) + '.' + '\n']
+        if init is not None:
+            new['init'] = [str(i) + '. \n' for i in init]
+        if plan is not None:
+            new['plan'] = [str(i) + '. \n' for i in plan if 'occurs' in i]
+        if history is not None:
+            new['history'] = [str(i) + '. \n' for i in history]
+        if ec is not None:
+            new['ec'] = [ec]
+        if ar is not None:
+            new['ar'] = [ar]
+        out = []
+        pos = 0
+        for start, end, name in sorted(self.regions[k] + (k,) for k in new):
+            out.extend(self.lines[pos:start])
+            out.extend(new[name])
+            pos = end
+        out.extend(self.lines[pos:])
+        return ''.join(out)
+
+    def derive(self, **parts):
+        """Returns a new template with the given regions replaced."""
+        return ProgramTemplate(text=self.render(**parts))
+
+    def save(self, filename, **parts):
+        with open(filename, 'w') as prog:
+            prog.write(self.render(**parts))
+
+
+def with_program(text, func, *args, **kwargs):
+    """Writes program text to a temporary file (tmpfs where
+    available) and calls func(path, *args, **kwargs), e.g.
+    with_program(text, jarwrapper, '-A')."""
+    fd, path = tempfile.mkstemp(suffix='.sp', dir=PROGRAM_TMP)
+    try:
+        with os.fdopen(fd, 'w') as prog:
+            prog.write(text)
+        return func(path, *args, **kwargs)
+    finally:
+        os.remove(path)
+
+
+def horizon_lower_bound(goal, init):
+    """A cheap lower bound on the plan length: 0 if the goal
+    literal already holds in the initial state, else 1."""
+    at_zero = goal.replace(',I)', ',0)')
+    return 0 if at_zero in init else 1
+
+
+def plan_deepening(template, min_n=1, max_n=None, step=1, solver=None, **parts):
+    """Solves the planning program with horizons min_n, min_n + step, ...
+    up to max_n (default: the program's own #const n), stopping at the
+    first horizon that yields answer sets. Since the planning module only
+    returns minimal plans, these are the plans the full horizon would give.
+    parts are passed on to template.render(). Returns the solver output
+    and the horizon used."""
+    solver = solver or jarwrapper
+    max_n = template.horizon() if max_n is None else max_n
+    n = min_n
+    while True:
+        n = min(n, max_n)
+        out = with_program(template.render(horizon=n, **parts), solver, '-A')
+        # warnings and other messages are not answer sets
+        if any(l.startswith('{') for l in out) or n >= max_n:
+            return out, n
+        n += step
+
+
+class IncrementalPlanner:
+    """Multi-shot planning with the clingo module: the program of
+    template (without goal and initial state) is translated and
+    grounded once, and each trial only sets its goal and initial
+    state before solving.
+
+    Initial state literals are declared #external, so init_facts
+    must cover every literal a trial may start from (e.g. the union
+    of the init_gen states used); the ground program includes the
+    rules for all of them. Each goal in goals gets a rule
+    goal(I) :- <goal>, inc_goal(k). with an external selector.
+    All externals are assigned before each solve, so nothing
+    carries over from one trial to the next. covers() tells if a
+    trial can be solved here; other trials need a fresh program."""
+    def __init__(self, template, init_facts, goals, translator=None):
+        import clingo
+        self.clingo = clingo
+        translator = translator or TranslationCache()
+        text = template.render(goal='', init=[])
+        lp = with_program(text, translator.translate)
+        self.shown = display_filter(text)
+        self.facts = dict((str(f), clingo.parse_term(str(f))) for f in set(init_facts))
+        self.goals = dict((str(g), clingo.Function('inc_goal', [clingo.Number(k)]))
+                          for k, g in enumerate(sorted(set(map(str, goals)))))
+        ext = ['#external %s.' % f for f in sorted(self.facts)]
+        for g, sel in sorted(self.goals.items()):
+            ext.append('#external %s.' % sel)
+            ext.append('goal(I) :- %s, %s.' % (g, sel))
+        self.ctl = clingo.Control(['0', '--opt-mode=optN'])
+        self.ctl.load(lp)
+        self.ctl.add('base', [], '\n'.join(ext))
+        self.ctl.ground([('base', [])])
+
+    def covers(self, goal, init):
+        return str(goal) in self.goals and all(str(i) in self.facts for i in init)
+
+    def answer_sets(self, goal, init, models=0):
+        """Returns the answer sets (lists of Atoms) for one goal
+        and initial state; models=0 gives all of them."""
+        init = set(map(str, init))
+        for f, sym in self.facts.items():
+            self.ctl.assign_external(sym, f in init)
+        for g, sel in self.goals.items():
+            self.ctl.assign_external(sel, g == str(goal))
+        self.ctl.configuration.solve.models = models
+        found = []
+        self.ctl.solve(on_model=lambda m: found.append((list(m.cost), _model_atoms(m, self.shown))))
+        return _optimal_models(found)
+
+    def solve(self, goal, init, models=0):
+        """As answer_sets, in the sparc output format."""
+        return ['{' + ', '.join([a.text for a in m]) + '}'
+                for m in self.answer_sets(goal, init, models)]
+
+
+def split_axioms(block):
+    """Splits an E.c. or A.R. block at its '% NN.' ID comments.
+    Returns the text before the first ID and a list of
+    (ID, text) pairs, where text starts with the ID comment."""
+    parts = re.split(r'%\s(\d+\.)', block)
+    axioms = [(int(parts[k][:-1]), '% ' + parts[k] + parts[k + 1])
+              for k in range(1, len(parts), 2)]
+    return parts[0], axioms
+
+
+class AxiomIndex:
+    """The E.c. ('ec') and A.R. ('ar') blocks of a program template,
+    split once into axioms keyed by ID (the IDs of the two blocks
+    overlap, so they are kept apart). variant() returns the template
+    of the program without a set of axioms, rendered on first use."""
+    def __init__(self, template):
+        self.template = template
+        self.blocks = dict((kind, split_axioms(template.region_text(kind)))
+                           for kind in ('ec', 'ar'))
+        self.variants = {}
+
+    def ids(self, kind):
+        return [ax_id for ax_id, rule in self.blocks[kind][1]]
+
+    def render(self, kind, to_del):
+        """Program text without the axioms to_del (an ID or
+        a list of IDs) of the given kind. Raises ValueError for
+        IDs the block does not have (e.g. the E.c. of diag-obs.sp,
+        whose ID comments are not of the '% NN.' form)."""
+        to_del = _axiom_ids(to_del)
+        preamble, axioms = self.blocks[kind]
+        unknown = sorted(set(to_del) - set(ax_id for ax_id, rule in axioms))
+        if unknown:
+            raise ValueError('no %s axioms with IDs %s in the program' % (kind, unknown))
+        # keep the rest, with their ID comments
+        kept = preamble + ''.join([rule for ax_id, rule in axioms if ax_id not in to_del])
+        return self.template.render(**{kind: kept})
+
+    def variant(self, kind, to_del):
+        key = (kind, tuple(sorted(_axiom_ids(to_del))))
+        if key not in self.variants:
+            self.variants[key] = ProgramTemplate(text=self.render(kind, to_del))
+        return self.variants[key]
+
+    def conditions(self, candidates, level):
+        """Deletion conditions of a level: an ID of candidates
+        for level 1, tuples of level IDs for higher levels."""
+        if level == 1:
+            return list(candidates)
+        return list(itertools.combinations(sorted(candidates), level))
+
+
+def _axiom_ids(to_del):
+    if isinstance(to_del, (list, tuple, set)):
+        return list(to_del)
+    return [to_del]
+
+
+def set_goal(inFile, outFile, goal):
+    """Adds a line setting the goal to the program
+    specified by inFile, and saves it to an output
+    file specified by outFile."""
+    ProgramTemplate(inFile).save(outFile, goal=goal)
+
+
+def out_to_list(sparc_output, atoms=False):
+    """Separates the output returned by jarwrapper
+    into a list of lists. With atoms=True the literals
+    are parsed into Atom records (see parse_output)."""
+    if atoms:
+        return parse_output(sparc_output)
+    # check if output is empty
+    if len(sparc_output)!=0:
+        sparc_output = [i[1:-1] for i in sparc_output]
+        sparc_output = [i.split(', ') for i in sparc_output]
+    return sparc_output
+
+
+try:
+    intern
+except NameError:
+    from sys import intern
+
+# literal: optional '-', predicate name and argument string
+_ATOM_RE = re.compile(r"(-?)(\w+)(?:\((.*)\))?$")
+# names mentioned in a literal (as in get_actors)
+_WORD_RE = re.compile(r"\b[\d\w]{2,}\b")
+
+
+def _split_args(text):
+    """Splits an argument string at its top-level commas,
+    whatever the nesting of the terms."""
+    args = []
+    depth = 0
+    start = 0
+    for k, ch in enumerate(text):
+        if ch == '(':
+            depth += 1
+        elif ch == ')':
+            depth -= 1
+        elif ch == ',' and depth == 0:
+            args.append(text[start:k].strip())
+            start = k + 1
+    args.append(text[start:].strip())
+    return args
+
+
+class Atom(object):
+    """A parsed literal, e.g. occurs(pick_up(robot,box1),3) has
+    pred 'occurs', args ('pick_up(robot,box1)', '3') and step 3.
+    step is the last argument if it is a number, else None.
+    Atoms compare equal to their text and support substring
+    tests, so the string helpers accept them as well."""
+    __slots__ = ('text', 'neg', 'pred', 'args', 'step')
+
+    def __init__(self, text):
+        self.text = text
+        m = _ATOM_RE.match(text)
+        self.neg = m.group(1) == '-'
+        self.pred = intern(m.group(2))
+        self.args = tuple(_split_args(m.group(3))) if m.group(3) else ()
+        self.step = int(self.args[-1]) if self.args and self.args[-1].isdigit() else None
+
+    def names(self):
+        return _WORD_RE.findall(self.text)
+
+    def __str__(self):
+        return self.text
+
+    def __repr__(self):
+        return 'Atom(%r)' % self.text
+
+    def __eq__(self, other):
+        return self.text == str(other)
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash(self.text)
+
+    def __contains__(self, s):
+        return s in self.text
+
+
+# atoms repeat across answer sets, so parsed atoms are shared
+_atom_cache = {}
+
+
+def parse_atom(text):
+    atom = _atom_cache.get(text)
+    if atom is None:
+        if len(_atom_cache) > 200000:
+            _atom_cache.clear()
+        atom = _atom_cache[text] = Atom(text)
+    return atom
+
+
+def parse_answer_set(line):
+    """Parses one answer set line '{a, b, ...}' into Atoms."""
+    return [parse_atom(t) for t in line.strip()[1:-1].split(', ') if t]
+
+
+def parse_output(sparc_output):
+    """Bulk mode: parses every answer set in the solver output
+    (header lines are skipped) into a list of lists of Atoms."""
+    return [parse_answer_set(l) for l in sparc_output if l.startswith('{')]
+
+
+def run_goal_gen(asp_filename):
+    """Finds the answer set of the
+    selected goal generation program,
+    returns a list of all fluents."""
+    args = [asp_filename, '-A']
+    # OUTPUT
+    result = jarwrapper(*args)
+    # the first answer set, as literal strings
+    fluent_set = parse_output(result)[0]
+    return [str(f) for f in fluent_set]
+
+
+# threads for overlapping solver calls, created per process
+_solver_threads = {}
+
+
+def solve_async(func, *args, **kwargs):
+    """Runs func(*args, **kwargs) (e.g. a solver call) on a thread
+    pool and returns an AsyncResult; .get() waits for the output.
+    Solver processes run outside the GIL, so independent calls
+    overlap without extra Python processes."""
+    pool = _solver_threads.get(os.getpid())
+    if pool is None:
+        pool = _solver_threads[os.getpid()] = ThreadPool(4)
+    return pool.apply_async(func, args, kwargs)
+
+
+def jarwrapper_async(*args):
+    """Non-blocking jarwrapper, see solve_async."""
+    return solve_async(jarwrapper, *args)
+
+
+def run_goal_gen_async(asp_filename):
+    """Non-blocking run_goal_gen, see solve_async."""
+    return solve_async(run_goal_gen, asp_filename)
+
+
+class Pipeline:
+    """Runs items through a chain of stages on threads. stages is a
+    list of (name, func, workers): each stage has its own worker
+    threads, which take items from a queue of at most maxsize items
+    and pass func(item) on to the next stage. While one stage works
+    on an item, the earlier stages go on with the following ones.
+    run() returns the results of the last stage in input order and
+    re-raises the first error of any stage, once all items are
+    through; with on_error, the result of an item that failed in
+    some stage is on_error(item, error) instead. stats() reports per
+    stage the items done, busy time, throughput (items/s of the
+    run), utilisation of its workers and the queue depth seen by
+    its workers."""
+    _END = object()
+
+    def __init__(self, stages, maxsize=4):
+        self.stages = stages
+        self.maxsize = maxsize
+
+    def _work(self, k, lock):
+        name, func, workers = self.stages[k]
+        q_in, q_out = self.queues[k], self.queues[k + 1]
+        st = self.st[k]
+        while True:
+            item = q_in.get()
+            if item is self._END:
+                break
+            depth = q_in.qsize()
+            idx, val, err = item
+            t = time.time()
+            if err is None:
+                try:
+                    val = func(val)
+                except Exception as e:
+                    err = e
+            with lock:
+                st['items'] += 1
+                st['busy'] += time.time() - t
+                st['depth_sum'] += depth
+                st['max_depth'] = max(st['max_depth'], depth)
+            q_out.put((idx, val, err))
+        with lock:
+            st['done'] += 1
+            last = st['done'] == workers
+        # the last worker of a stage ends the next one
+        if last and k + 1 < len(self.stages):
+            for w in range(self.stages[k + 1][2]):
+                q_out.put(self._END)
+
+    def run(self, items, on_error=None):
+        items = list(items)
+        lock = threading.Lock()
+        self.queues = [queue.Queue(self.maxsize) for s in self.stages] + [queue.Queue()]
+        self.st = [dict(items=0, busy=0.0, depth_sum=0, max_depth=0, done=0)
+                   for s in self.stages]
+        threads = []
+        for k, (name, func, workers) in enumerate(self.stages):
+            for w in range(workers):
+                th = threading.Thread(target=self._work, args=(k, lock))
+                th.daemon = True
+                th.start()
+                threads.append(th)
+        t = time.time()
+        for idx, item in enumerate(items):
+            self.queues[0].put((idx, item, None))
+        for w in range(self.stages[0][2]):
+            self.queues[0].put(self._END)
+        results = [None] * len(items)
+        error = None
+        for n in range(len(items)):
+            idx, val, err = self.queues[-1].get()
+            if err is not None and on_error is not None:
+                val, err = on_error(items[idx], err), None
+            results[idx] = val
+            error = error or err
+        for th in threads:
+            th.join()
+        self.wall = time.time() - t
+        if error is not None:
+            raise error
+        return results
+
+    def stats(self):
+        out = OrderedDict()
+        for (name, func, workers), st in zip(self.stages, self.st):
+            n = max(st['items'], 1)
+            out[name] = {'items': st['items'], 'busy': st['busy'],
+                         'throughput': st['items'] / self.wall if self.wall else float('nan'),
+                         'utilisation': st['busy'] / (self.wall * workers) if self.wall else float('nan'),
+                         'mean_depth': st['depth_sum'] / float(n), 'max_depth': st['max_depth']}
+        return out
+
+
+class TrialData:
+    """A simple object for data collection.
+    Keeps the goal literal, execution time,
+    plan arity, set of plans, and number
+    of plans returned in lists.
+    This layout should be improved once it
+    is clear what structure is preferrable
+    for data analysis, e.g. to  access
+    individual entries (trials). """
+    def __init__(self):
+        self.trial = []
+        self.goal = []
+        self.success = []
+        self.exe_t = []
+        self.arity = []
+        self.plans = []
+        self.no_plans = []
+        self.missing_ax = []    # missing axioms
+        self.no_of_missing_ax = []  # number of missing axioms
+        self.init_cond = []  # initial conditions
+        self.goalID = []    # simple code for goal literals
+        self.horizon = []   # planning horizon used
+        self.cpu_t = []     # solver (child process) CPU time
+        self.max_rss = []   # solver peak memory (kB)
+        self.phases = []    # solver time per phase (dict)
+        self.outcome = []   # 'ok', 'retry', 'timeout' or 'memout'
+        self.axiom_type = []    # 'ar' or 'ec', the kind of missing axioms
+        self.plan = []      # plans
+        self.correct = []   # ground truth success
+        self.expl = []      # diagnostics output
+
+
+class StringPool:
+    """Dictionary encoding of strings (or tuples) as int codes."""
+    def __init__(self):
+        self.codes = {}
+        self.values = []
+
+    def encode(self, value):
+        code = self.codes.get(value)
+        if code is None:
+            code = self.codes[value] = len(self.values)
+            self.values.append(value)
+        return code
+
+
+def _ragged_take(ptr, idx):
+    """For a ragged array with row offsets ptr, returns the offsets
+    and the flat element indices of the rows idx."""
+    lengths = ptr[idx + 1] - ptr[idx]
+    new_ptr = np.zeros(len(idx) + 1, dtype=np.int64)
+    np.cumsum(lengths, out=new_ptr[1:])
+    flat = np.arange(new_ptr[-1]) + np.repeat(ptr[idx] - new_ptr[:-1], lengths)
+    return new_ptr, flat
+
+
+class TrialStore:
+    """Columnar storage for trials, as an alternative to the lists
+    of TrialData. Numeric fields are typed numpy arrays which grow
+    by doubling; goals, actions, initial states and deleted axioms
+    are dictionary encoded, and the plans of all trials are kept as
+    two levels of offsets (trial -> plans -> actions) into one array
+    of action codes. select() takes a slice, index array or boolean mask, e.g.
+    store.select(store.col('arity') < 999)."""
+    NUMERIC = [('trial', np.int32), ('success', np.int8), ('exe_t', np.float64),
+               ('arity', np.int16), ('horizon', np.int16), ('no_plans', np.int32),
+               ('cpu_t', np.float64), ('max_rss', np.int64),
+               ('missing_ax', np.int32), ('no_of_missing_ax', np.int8),
+               ('goal', np.int32), ('init_cond', np.int32), ('outcome', np.int8),
+               ('axiom_type', np.int8)]
+    OUTCOMES = ['ok', 'retry', 'timeout', 'memout']
+    AXIOM_TYPES = ['ar', 'ec']
+
+    def __init__(self, capacity=1024, pools=None):
+        self.n = 0
+        self.cols = dict((name, np.zeros(capacity, dtype)) for name, dtype in self.NUMERIC)
+        # goal, action, initial state and axiom codes (shared by selections)
+        self.pools = pools or {'goal': StringPool(), 'action': StringPool(),
+                               'init_cond': StringPool(), 'missing_ax': StringPool()}
+        self.plan_ptr = np.zeros(capacity + 1, np.int64)
+        self.action_ptr = np.zeros(1024, np.int64)
+        self.actions = np.zeros(1024, np.int32)
+        self.n_plans = 0
+        self.n_actions = 0
+
+    def __len__(self):
+        return self.n
+
+    def _grow(self, arr, size):
+        if size <= len(arr):
+            return arr
+        new = np.zeros(max(size, 2 * len(arr)), arr.dtype)
+        new[:len(arr)] = arr
+        return new
+
+    def append(self, rec):
+        """Adds one trial record (as returned by Experiment1.run_trial)."""
+        i = self.n
+        for name, dtype in self.NUMERIC:
+            self.cols[name] = self._grow(self.cols[name], i + 1)
+        self.plan_ptr = self._grow(self.plan_ptr, i + 2)
+        for name, dtype in self.NUMERIC:
+            val = rec.get(name, -1)
+            if name == 'goal':
+                val = self.pools['goal'].encode(val)
+            elif name == 'init_cond':
+                val = self.pools['init_cond'].encode(tuple(rec.get(name, ())))
+            elif name == 'missing_ax':
+                # an axiom ID, or a tuple of IDs above level 1
+                if isinstance(val, list):
+                    val = tuple(val)
+                val = self.pools['missing_ax'].encode(val)
+            elif name == 'outcome':
+                val = self.OUTCOMES.index(rec.get(name, 'ok'))
+            elif name == 'axiom_type':
+                val = self.AXIOM_TYPES.index(rec.get(name, 'ar'))
+            self.cols[name][i] = val
+        plans = rec.get('plans', [])
+        self.action_ptr = self._grow(self.action_ptr, self.n_plans + len(plans) + 1)
+        for plan in plans:
+            codes = [self.pools['action'].encode(str(a)) for a in plan]
+            self.actions = self._grow(self.actions, self.n_actions + len(codes))
+            self.actions[self.n_actions:self.n_actions + len(codes)] = codes
+            self.n_actions += len(codes)
+            self.n_plans += 1
+            self.action_ptr[self.n_plans] = self.n_actions
+        self.plan_ptr[i + 1] = self.n_plans
+        self.n += 1
+
+    def col(self, name):
+        """Returns a view of a numeric (or code) column."""
+        return self.cols[name][:self.n]
+
+    def goals(self):
+        return [self.pools['goal'].values[c] for c in self.col('goal')]
+
+    def missing_ax(self):
+        return [self.pools['missing_ax'].values[c] for c in self.col('missing_ax')]
+
+    def init_cond(self, i):
+        return list(self.pools['init_cond'].values[self.cols['init_cond'][i]])
+
+    def plans(self, i):
+        """Decodes the plans of trial i into lists of actions."""
+        values = self.pools['action'].values
+        return [[values[c] for c in self.actions[self.action_ptr[p]:self.action_ptr[p + 1]]]
+                for p in range(self.plan_ptr[i], self.plan_ptr[i + 1])]
+
+    def select(self, sel):
+        """Returns a new store with the selected trials."""
+        idx = np.arange(self.n)[sel]
+        out = TrialStore(max(len(idx), 1), self.pools)
+        for name, dtype in self.NUMERIC:
+            out.cols[name][:len(idx)] = self.cols[name][idx]
+        out.plan_ptr, plan_idx = _ragged_take(self.plan_ptr, idx)
+        out.action_ptr, action_idx = _ragged_take(self.action_ptr, plan_idx)
+        out.actions = self.actions[action_idx]
+        out.n = len(idx)
+        out.n_plans = len(plan_idx)
+        out.n_actions = len(action_idx)
+        return out
+
+    __getitem__ = select
+
+    @classmethod
+    def from_trialdata(cls, data):
+        store = cls(max(len(data.trial), 1))
+        fields = [name for name, dtype in cls.NUMERIC] + ['plans']
+        for i in range(len(data.trial)):
+            rec = {}
+            for name in fields:
+                values = getattr(data, name)
+                if i < len(values):
+                    rec[name] = values[i]
+            store.append(rec)
+        return store
+
+    def to_trialdata(self):
+        data = TrialData()
+        for i in range(self.n):
+            for name, dtype in self.NUMERIC:
+                if name in ('goal', 'missing_ax'):
+                    val = self.pools[name].values[self.cols[name][i]]
+                elif name == 'init_cond':
+                    val = self.init_cond(i)
+                elif name == 'outcome':
+                    val = self.OUTCOMES[self.cols[name][i]]
+                elif name == 'axiom_type':
+                    val = self.AXIOM_TYPES[self.cols[name][i]]
+                else:
+                    val = self.cols[name][i].item()
+                getattr(data, name).append(val)
+            data.plans.append(self.plans(i))
+        return data
+
+
+class InitPool:
+    """A pool of initial states, enumerated from init_gen once and
+    drawn from with a seeded RNG. Up to n_enum answer sets are read
+    from the solver and size of them are kept by reservoir sampling
+    (all of them if n_enum <= size). Literals mentioning any name
+    in drop are removed. States are stored like the TrialStore plans:
+    literal codes in one array with row offsets. If stratify is
+    given, draw() picks a stratum (the value of stratify(state))
+    uniformly and then a state within it."""
+    def __init__(self, prog_file=None, size=1000, n_enum=None, seed=0, stratify=None,
+                 drop=('can_support',), states=None):
+        self.seed(seed)
+        self.pool = StringPool()
+        if states is None:
+            states = self._sample(prog_file, size, n_enum or size)
+        self.ptr = np.zeros(len(states) + 1, dtype=np.int64)
+        codes = []
+        for k, state in enumerate(states):
+            lits = [l for l in state if not any(d in l for d in drop)]
+            codes.extend(self.pool.encode(l) for l in lits)
+            self.ptr[k + 1] = len(codes)
+        self.codes = np.array(codes, dtype=np.int32)
+        self.strata = None
+        if stratify:
+            strata = {}
+            for k in range(len(self)):
+                strata.setdefault(stratify(self[k]), []).append(k)
+            self.strata = [np.array(v) for key, v in sorted(strata.items())]
+
+    def _sample(self, prog_file, size, n_enum):
+        kept = []
+        for k, state in enumerate(stream_answer_sets(prog_file, '-A', '-n', str(n_enum))):
+            if k < size:
+                kept.append(state)
+            else:
+                j = self.rng.randint(0, k + 1)
+                if j < size:
+                    kept[j] = state
+        return kept
+
+    def seed(self, seed):
+        self.rng = np.random.RandomState(seed)
+
+    def __len__(self):
+        return len(self.ptr) - 1
+
+    def __getitem__(self, k):
+        return [self.pool.values[c] for c in self.codes[self.ptr[k]:self.ptr[k + 1]]]
+
+    def draw(self):
+        """Returns a random initial state (a list of literals)."""
+        if self.strata:
+            stratum = self.strata[self.rng.randint(len(self.strata))]
+            return self[stratum[self.rng.randint(len(stratum))]]
+        return self[self.rng.randint(len(self))]
+
+    def facts(self):
+        """All literals occurring in the pool, e.g. the init_facts
+        of an IncrementalPlanner."""
+        return list(self.pool.values)
+
+    def save(self, filename):
+        np.savez_compressed(filename, ptr=self.ptr, codes=self.codes,
+                            values=np.array(self.pool.values))
+
+    @classmethod
+    def load(cls, filename, seed=0, stratify=None):
+        data = np.load(filename)
+        values = [str(v) for v in data['values']]
+        ptr, codes = data['ptr'], data['codes']
+        states = [[values[c] for c in codes[ptr[k]:ptr[k + 1]]] for k in range(len(ptr) - 1)]
+        return cls(states=states, seed=seed, stratify=stratify)
+
+
+#class TrialData:
+#    """A simple object for data collection in the second experiment.
+#    Keeps all categories of ExpCOndition, and adds success, plan
+#    correctness, and explanations for failed plans. """
+#    def __init__(self):
+#        self.goal = []      # goal literal
+#        self.goalID = []    # simple code for goal literals
+#        self.plan = []      # plans
+#        self.success = []   # goal achieved
+#        self.correct = []   # ground truth success
+#        self.init_cond = []  # initial conditions
+#        self.expl = []      # diagnostics output
+
+
+
+def find_plan_length(plan_list):
+    """Finds plan length indicated by the predicate
+    plan_length(i), where i is the first time step
+    when the goal holds."""
+    if len(plan_list) == 0:
+        # no plans were returned
+        plan_length = 0
+    else:
+        # find the plan_length literal by name: its position depends on
+        # the solver (sparc prints it second, clingo in symbol order)
+        lengths = [str(a) for a in plan_list[0] if str(a).startswith('plan_length(')]
+        plan_len_pred = lengths[0] if lengths else str(plan_list[0][1])
+        # scan it for a number
+        re_out = re.search(r"\d+", plan_len_pred)
+        # access the match and convert to an integer
+        plan_length = int(re_out.group(0))
+        if plan_length == 0:
+            plan_length = 999
+    return plan_length
+
+
+def get_step(literal):
+    """Finds the time step of a given literal.
+    It is assumed that time steps are always
+    the last item of the literal."""
+    if isinstance(literal, Atom) and literal.step is not None:
+        return literal.step
+    # scan input for numbers
+    re_out = re.findall(r"\d+", str(literal))
+    # access the match and convert to an integer
+    step = int(re_out[-1])
+    return step
+
+
+def get_actors(plan):
+    """Returns a list of obj. and agents
+    appearing in the plan."""
+    words = []
+    for i in plan:
+        words.extend(_WORD_RE.findall(str(i)))
+    # remove occurs / plan_length
+    actors = []
+    actors = [i for i in words if not 'occurs' in i]
+    actors = [i for i in actors if not 'plan_length' in i]
+    actors = [i for i in actors if not 'goal' in i]
+    actors = [i for i in actors if not 'room' in i]
+    actors = [i for i in actors if not 'corridor' in i]
+    # 3. return list
+    return actors
+
+
+class HistoryIndex:
+    """Index of a world-sim history (list of literals), built
+    once: positions of the literals by time step, and by
+    (time step, name) for every name a literal mentions.
+    Literal order of the history is preserved in lookups."""
+    def __init__(self, history):
+        # remove success from hist:
+        self.items = [i for i in history if not 'success' in i]
+        self.by_step = {}
+        self.by_name = {}
+        for pos, item in enumerate(self.items):
+            step = get_step(item)
+            self.by_step.setdefault(step, []).append(pos)
+            for name in set(_WORD_RE.findall(str(item))):
+                self.by_name.setdefault((step, name), []).append(pos)
+
+    def at_step(self, step):
+        return [self.items[p] for p in self.by_step.get(step, [])]
+
+    def mentioning(self, step, names):
+        """Literals at step which mention any of names."""
+        found = set()
+        for name in names:
+            found.update(self.by_name.get((step, name), []))
+        return [self.items[p] for p in sorted(found)]
+
+
+def hist_search(history, occ_plan, index=None):
+    """Returns the history relevant to a plan: everything at
+    step 0, then for each later step the literals mentioning
+    the actors of the preceding action. A prebuilt
+    HistoryIndex of the history may be passed in."""
+    pln = [i for i in occ_plan if 'occurs' in i]
+    steps = len(pln)
+    if index is None:
+        index = HistoryIndex(history)
+    # add all items from 0th timestep:
+    ordered_hist = index.at_step(0)
+    for step in range(1,steps):
+        # get relevant actors for that step
+        current_actors = get_actors(pln[step-1:step])
+        # relevant history:
+        ordered_hist.extend(index.mentioning(step, current_actors))
+    return ordered_hist
+
+
+def add_init_state(program, out_prog, state):
+    """Replaces the initial condition block of program
+    with the list of literals in state."""
+    ProgramTemplate(program).save(out_prog, init=state)
+
+
+def add_plan(plan, in_prog, out_prog):
+    """Replaces the plan block of in_prog with the
+    occurs literals of plan."""
+    ProgramTemplate(in_prog).save(out_prog, plan=plan)
+
+
+def determine_success(asp_output):
+    s = 'success'
+    if s in asp_output:
+        sb = 1
+    else:
+        sb = 0
+    return sb
+    
+    
+def plan_check(formatted_output):
+    """Check if plan is pointless, i.e.
+    true at t=0. """
+    
+    
+def occ_filter(plan_ls):
+    new_ls = []
+    for plan in plan_ls:
+        plan = [i for i in plan if 'occurs' in i]
+        new_ls.append(plan)
+    return new_ls
+
+
+# objects the planning program treats alike (the #object sort):
+# trials differing only by a renaming of these have the same plans
+SYMMETRIC_OBJECTS = ('box1', 'box2', 'box3', 'box4', 'box5', 'box6', 'chair', 'cup')
+
+
+def rename(literals, mapping):
+    """Renames the names in a list of literals (or output lines)."""
+    sub = lambda m: mapping.get(m.group(0), m.group(0))
+    return [_WORD_RE.sub(sub, str(l)) for l in literals]
+
+
+def canonical_form(goal, init, objects=SYMMETRIC_OBJECTS, max_perms=5040):
+    """Canonical form of a (goal, initial state) pair under renaming
+    of objects. Objects are coloured by their literals (static
+    properties first, then refined by the colours of the objects they
+    are related to) and numbered by colour; ties are broken by trying
+    all orders of the tied objects, up to max_perms of them. Returns
+    the form (a tuple of renamed literals) and the renaming used.
+    Pairs with the same form are renamings of each other."""
+    lits = ['goal:' + str(goal)] + sorted(map(str, init))
+    words = [set(_WORD_RE.findall(l)) for l in lits]
+    present = sorted(set(w for ws in words for w in ws if w in objects))
+    colour = dict((o, 0) for o in present)
+    n_colours = 1
+    while True:
+        sig = dict((o, []) for o in present)
+        for l, ws in zip(lits, words):
+            for o in ws.intersection(sig):
+                marks = dict((p, '<%d>' % colour[p]) for p in present)
+                marks[o] = '<self>'
+                sig[o].append(rename([l], marks)[0])
+        sig = dict((o, (colour[o], sorted(v))) for o, v in sig.items())
+        ranks = sorted(set(map(repr, sig.values())))
+        colour = dict((o, ranks.index(repr(sig[o]))) for o in present)
+        if len(ranks) == n_colours:
+            break
+        n_colours = len(ranks)
+    groups = [[o for o in present if colour[o] == c] for c in range(n_colours)]
+    n_perms = 1
+    for g in groups:
+        for k in range(2, len(g) + 1):
+            n_perms *= k
+    orders = itertools.product(*[itertools.permutations(g) for g in groups])
+    if n_perms > max_perms:
+        # no search: still a valid renaming, equal pairs may differ
+        orders = [groups]
+    best = None
+    for order in orders:
+        names = [o for g in order for o in g]
+        mapping = dict((o, 'obj%d' % k) for k, o in enumerate(names))
+        form = tuple(sorted(rename(lits, mapping)))
+        if best is None or form < best[0]:
+            best = (form, mapping)
+    return best
+
+
+class Experiment1:
+    """Loop through deletion conditions efficiently"""
+
+    def __init__(self):
+        
+        self.asp_init = 'init_gen.sp'
+        self.asp_goal_set = 'goal-gen-with-constraints.sp'
+        self.asp_complete = 'bw-translation-from-al-3.sp'
+        self.asp_partial = 'bw-al-3-partial.sp'
+        #  Generate all possible goals for this domain
+        self.goal_ls = run_goal_gen(self.asp_goal_set)
+    
+        # Get a random set of initial conditions
+        self.init_out = jarwrapper(self.asp_init, '-A ', '-n', '1')
+        self.init_out = rm_header(self.init_out)
+        self.init_list = out_to_list(self.init_out)
+        # remove can_support :
+        self.init_list = [i for i in self.init_list[0] if not 'can_support' in i]
+    
+        # Choose file names for programs with altered goals,
+        # the source programs are left unchanged.
+        self.target_cdk = 'rand-goal-cdk.sp'
+        self.target_pdk = 'rand-goal-pdk.sp'
+        
+        self.ec_to_test = [13, 15, 18]
+        self.ar_to_test = [13, 14, 15, 16, 21, 28, 31, 32] # not sure about 31 and 32
+
+        # programs are parsed once and rendered in memory
+        self.cdk_template = ProgramTemplate(self.asp_complete)
+        self.axioms = AxiomIndex(self.cdk_template)
+        # search horizons incrementally instead of the full #const n
+        self.deepening = False
+        # keep only the first max_plans plans of each solve (None: all)
+        self.max_plans = None
+        # solve CDK and PDK of a trial at the same time
+        self.overlap = False
+        # InitPool to draw initial states from (None: solve init_gen per trial)
+        self.init_pool = None
+        # (init_facts, goals, translator) for multi-shot solving, see use_incremental
+        self.incremental = None
+        self.planners = {}
+        # {} to solve one trial per class of renamed trials, see solve
+        self.symmetry = None
+        # retries after a solver timeout / memout, in order: ('horizon', n)
+        # solves with a smaller horizon, ('max_plans', k) keeps the first k plans
+        self.retry = []
+
+
+    def render_pdk(self, template, axiom_type, n_del, *args):
+        # Create Partial domain knowledge script and set deletion of information:
+        """ template - ProgramTemplate of the complete program,
+        axiom type - aff. relations or exec. conditions,
+        n_del - number of axioms to delete
+        del_idx - (optional) list of axiom IDs to delete
+        Returns the text of the partial program."""
+        to_del = args[0] if args else []
+        #if not args: to_del = random.sample(self.ec_to_test / self.ar_to_test, n_del)
+        if template is self.cdk_template:
+            return self.axioms.render(axiom_type, to_del)
+        return AxiomIndex(template).render(axiom_type, to_del)
+
+
+    def create_pdk(self, in_prog, out_prog, axiom_type, n_del, *args):
+        """Writes the partial program of in_prog to out_prog,
+        see render_pdk."""
+        pdk_script = self.render_pdk(ProgramTemplate(in_prog), axiom_type, n_del, *args)
+        with open(out_prog, 'w') as f:
+            f.write(pdk_script)
+
+
+    def pdk_template(self, axiom_type, to_del):
+        """Returns the (memoized) template of the partial program
+        with the axioms in to_del (an ID or a list of IDs) removed."""
+        return self.axioms.variant(axiom_type, to_del)
+
+
+    def conditions(self, axiom_type, level):
+        """Deletion conditions of a level (1-3) for the axioms
+        under test, see AxiomIndex.conditions."""
+        candidates = self.ar_to_test if axiom_type == 'ar' else self.ec_to_test
+        return self.axioms.conditions(candidates, level)
+
+
+    def use_incremental(self, init_facts, goals, translator=None):
+        """Solves trials with an IncrementalPlanner per program,
+        grounded once for the given initial state literals and
+        goals. Trials outside of these use the solver as before."""
+        self.incremental = (init_facts, goals, translator)
+        self.planners = {}
+
+
+    def planner(self, prog):
+        if id(prog) not in self.planners:
+            self.planners[id(prog)] = IncrementalPlanner(prog, *self.incremental)
+        return self.planners[id(prog)]
+
+    def __getstate__(self):
+        # for worker processes: clingo controls don't pickle, and the
+        # planners are keyed by id() of templates of this process
+        state = dict(self.__dict__)
+        state['planners'] = {}
+        return state
+
+
+    def solve(self, prog, goal, init_list, solver):
+        """Solves one knowledge condition, returns the output,
+        the horizon used, wall time and the solver call timings.
+        With symmetry set, trials that are renamings of a solved one
+        (see canonical_form) get its results, renamed; the timings
+        are those of the solved trial."""
+        if self.symmetry is not None:
+            form, mapping = canonical_form(goal, init_list)
+            key = (id(prog), form)
+            if key not in self.symmetry:
+                out, horizon, wall, stats = self.solve_program(prog, goal, init_list, solver)
+                self.symmetry[key] = (rename(out, mapping), horizon, wall, stats)
+            out, horizon, wall, stats = self.symmetry[key]
+            back = dict((v, k) for k, v in mapping.items())
+            return rename(out, back), horizon, wall, stats
+        return self.solve_program(prog, goal, init_list, solver)
+
+
+    def solve_program(self, prog, goal, init_list, solver):
+        """Solves as in solve. Calls stopped by the solver limits
+        (SolverTimeout) are retried as set in self.retry; if these
+        fail too, the output is empty and stats['outcome'] says why
+        ('timeout' or 'memout'; 'retry' if a retry succeeded)."""
+        t = time.time()
+        try:
+            return self.solve_once(prog, goal, init_list, solver)
+        except SolverTimeout as e:
+            failed = e
+        for kind, value in self.retry:
+            horizon = None
+            retry_solver = solver
+            if kind == 'horizon':
+                horizon = value
+            else:
+                retry_solver = functools.partial(jarwrapper_limited, max_sets=value)
+            try:
+                out, horizon, wall, stats = self.solve_once(prog, goal, init_list,
+                                                            retry_solver, horizon)
+            except SolverTimeout as e:
+                failed = e
+                continue
+            return out, horizon, time.time() - t, dict(stats, outcome='retry')
+        return [], prog.horizon(), time.time() - t, dict(failed.stats, outcome=failed.kind)
+
+
+    def solve_once(self, prog, goal, init_list, solver, horizon=None):
+        # Execute program, save output
+        _call_stats.last = None
+        t = time.time()
+        if self.deepening:
+            out, horizon = plan_deepening(prog, horizon_lower_bound(goal, init_list), horizon,
+                                          solver=solver, goal=goal, init=init_list)
+        elif (self.incremental and horizon is None
+              and self.planner(prog).covers(goal, init_list)):
+            out = self.planner(prog).solve(goal, init_list, self.max_plans or 0)
+            horizon = prog.horizon()
+        else:
+            # Render the goal and state into the program.
+            out = with_program(prog.render(goal=goal, init=init_list, horizon=horizon),
+                               solver, '-A')
+            horizon = horizon or prog.horizon()
+        return out, horizon, time.time() - t, last_call_stats() or {}
+
+
+    def init_state(self):
+        """Returns a starting state, from the init_pool if set."""
+        if self.init_pool is not None:
+            return self.init_pool.draw()
+        init_out = jarwrapper(self.asp_init, '-A ', '-n', '1')
+        init_out = rm_header(init_out)
+        init_list = out_to_list(init_out)
+        # remove can_support :
+        return [i for i in init_list[0] if not 'can_support' in i]
+
+
+    def run_trial(self, trial, goal, deleted_ax, level, pdk, init_list=None, axiom_type='ar'):
+        """Runs one (axiom, goal) cell: renders the goal and a fresh
+        initial state (or init_list) into the complete program and
+        the partial program template pdk (without the deleted_ax of
+        axiom_type), solves both and returns a record for the
+        complete and the partial knowledge condition."""
+        # Set starting conditions:
+        init_failed = None
+        if init_list is None:
+            try:
+                init_list = self.init_state()
+            except SolverTimeout as e:
+                # no starting state: both conditions get its outcome
+                init_failed, init_list = e, []
+
+        solver = jarwrapper
+        if self.max_plans:
+            solver = functools.partial(jarwrapper_limited, max_sets=self.max_plans)
+
+        # CDK and PDK are independent and may be solved concurrently
+        progs = [self.cdk_template, pdk]
+        if init_failed is not None:
+            stats = dict(init_failed.stats, outcome=init_failed.kind)
+            solved = [([], prog.horizon(), stats.get('wall', float('nan')), stats) for prog in progs]
+        elif self.overlap:
+            pending = [solve_async(self.solve, prog, goal, init_list, solver) for prog in progs]
+            solved = [p.get() for p in pending]
+        else:
+            solved = [self.solve(prog, goal, init_list, solver) for prog in progs]
+
+        records = []
+        for out, horizon, exe_t, stats in solved:
+            t_parse = time.time()
+            out = rm_header(out)
+            plan_ls = out_to_list(out)
+            p_len = find_plan_length(plan_ls)
+            plan_ls = occ_filter(plan_ls)
+            phases = dict((k, stats.get(k, float('nan'))) for k in ['start', 'translate', 'solve'])
+            phases['parse'] = time.time() - t_parse
+            records.append({'trial': trial,
+                            'goal': goal,
+                            'success': determine_success(out),
+                            'arity': p_len,
+                            'horizon': horizon,
+                            'exe_t': exe_t,
+                            'cpu_t': stats.get('user', 0.0) + stats.get('sys', 0.0),
+                            'max_rss': stats.get('max_rss', 0),
+                            'phases': phases,
+                            'plans': plan_ls,
+                            'no_plans': len(plan_ls),
+                            'missing_ax': deleted_ax,
+                            'no_of_missing_ax': level,
+                            'axiom_type': axiom_type,
+                            'init_cond': init_list,
+                            'outcome': stats.get('outcome', 'ok')})
+        return records[0], records[1]
+
+
+def record_trial(data, rec):
+    """Appends a trial record (dict of field: value) to
+    TrialData or a TrialStore."""
+    if isinstance(data, TrialStore):
+        data.append(rec)
+        return
+    for key, val in rec.items():
+        getattr(data, key).append(val)
+
+
+class TrialJournal:
+    """Append-only journal of finished Experiment 1 cells, one json
+    line per cell with its key (axiom type, level, deleted axioms,
+    goal) and the complete and partial records. Lines are flushed
+    to disk as cells finish; a line cut short by a crash is ignored
+    when the journal is read back. done() tells which cells can be
+    skipped when a run is resumed, and replay() appends the journaled
+    records to TrialData or TrialStore objects."""
+    def __init__(self, filename):
+        self.filename = filename
+        self.entries = OrderedDict()
+        if os.path.exists(filename):
+            with open(filename) as f:
+                line = ''
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        continue
+                    self.entries[json.dumps(entry['key'])] = entry['records']
+                # start a new line after one cut short
+                if line and not line.endswith('\n'):
+                    with open(filename, 'a') as f:
+                        f.write('\n')
+        self.file = open(filename, 'a')
+
+    def done(self, key):
+        return json.dumps(key) in self.entries
+
+    def record(self, key, cdk_rec, pdk_rec):
+        line = json.dumps({'key': key, 'records': [cdk_rec, pdk_rec]}, default=str)
+        self.file.write(line + '\n')
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.entries[json.dumps(key)] = [cdk_rec, pdk_rec]
+
+    def replay(self, complete, partial):
+        for key, (cdk_rec, pdk_rec) in self.entries.items():
+            for data, rec in ((complete, cdk_rec), (partial, pdk_rec)):
+                rec = dict(rec)
+                rec.setdefault('axiom_type', json.loads(key)[0])
+                if isinstance(rec.get('missing_ax'), list):
+                    rec['missing_ax'] = tuple(rec['missing_ax'])
+                record_trial(data, rec)
+
+    def close(self):
+        self.file.close()
+
+
+class ResultSink:
+    """Writes tab separated rows to a file as they are produced.
+    Rows are buffered and written out in batches, once batch_rows
+    rows or batch_bytes bytes are buffered or flush_every seconds
+    have passed since the last write, and on close(). If filename
+    ends with .gz, each batch is written as a gzip member, so the
+    rows written so far can be read (e.g. with zcat) during a run.
+    The header is written if the file is new."""
+    def __init__(self, filename, header, batch_rows=1000, batch_bytes=2**20, flush_every=30.0):
+        self.filename = filename
+        self.batch_rows = batch_rows
+        self.batch_bytes = batch_bytes
+        self.flush_every = flush_every
+        self.opener = gzip.open if filename.endswith('.gz') else open
+        self.buf = StringIO()
+        self.writer = csv.writer(self.buf, delimiter='\t', lineterminator='\n')
+        self.n_rows = 0
+        self.last_flush = time.time()
+        if not os.path.exists(filename) or not os.path.getsize(filename):
+            self.writerow(header)
+
+    def writerow(self, row):
+        self.writer.writerow(row)
+        self.n_rows += 1
+        if (self.n_rows >= self.batch_rows or self.buf.tell() >= self.batch_bytes
+                or time.time() - self.last_flush >= self.flush_every):
+            self.flush()
+
+    def writerows(self, rows):
+        for row in rows:
+            self.writerow(row)
+
+    def flush(self):
+        data = self.buf.getvalue()
+        if data:
+            with self.opener(self.filename, 'ab') as f:
+                f.write(data if isinstance(data, bytes) else data.encode('utf-8'))
+        self.buf.seek(0)
+        self.buf.truncate()
+        self.n_rows = 0
+        self.last_flush = time.time()
+
+    def close(self):
+        self.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class TrialSink(ResultSink):
+    """ResultSink for Experiment 1 records, with one row per action
+    of each plan (plans numbered through the whole run). Trials
+    without a plan (arity 999) are left out, unless the solver was
+    stopped (outcome other than 'ok'); these and empty plans get a
+    row with nan for step and action."""
+    HEAD = ['plan', 'trial', 'goal', 'arity', 'exe_t', 'step', 'action',
+            'no_plans', 'success', 'missing_ax', 'n_missing', 'condition', 'outcome']
+
+    def __init__(self, filename, **policy):
+        self.plan = 1
+        # continue the plan numbers of a resumed run
+        if os.path.exists(filename):
+            opener = gzip.open if filename.endswith('.gz') else open
+            with opener(filename, 'rb') as f:
+                for line in f:
+                    first = line.split(b'\t', 1)[0]
+                    if first.isdigit():
+                        self.plan = max(self.plan, int(first) + 1)
+        ResultSink.__init__(self, filename, self.HEAD, **policy)
+
+    def write_trial(self, rec, condition):
+        outcome = rec.get('outcome', 'ok')
+        plans = rec['plans']
+        if not plans and outcome != 'ok':
+            plans = [[]]
+        elif rec['arity'] == 999:
+            return
+        for j, curr_plan in enumerate(plans):
+            head = [self.plan, rec['trial'], rec['goal'], rec['arity'], rec['exe_t']]
+            tail = [rec['no_plans'], rec['success'], rec['missing_ax'],
+                    rec['no_of_missing_ax'], condition, outcome]
+            acts = [act for act in curr_plan if act]
+            if not acts:
+                self.writerow(head + ['nan', 'nan'] + tail)
+            for act in acts:
+                self.writerow(head + [j, act] + tail)
+            self.plan += 1
+
+    def write_data(self, partial, complete):
+        """Writes all trials of two TrialData objects, the partial
+        and complete records of each trial in turn."""
+        fields = ['trial', 'goal', 'arity', 'exe_t', 'plans', 'no_plans', 'success',
+                  'missing_ax', 'no_of_missing_ax']
+        for i in range(len(partial.goal)):
+            for data, condition in ((partial, 'PDK_exp1'), (complete, 'CDK_exp1')):
+                rec = dict((f, getattr(data, f)[i]) for f in fields)
+                if i < len(data.outcome):
+                    rec['outcome'] = data.outcome[i]
+                self.write_trial(rec, condition)
+
+
+def _cell_key(job):
+    e, i, goal, deleted_ax, level, seed, axiom_type = job
+    return (axiom_type, level, deleted_ax, goal)
+
+
+# the Experiment1 of a run_grid worker process, set once by
+# _init_grid_worker; its planners, symmetry classes and axiom
+# variants are built up in the worker over all of its cells
+_grid_exp = None
+
+
+def _init_grid_worker(exp):
+    global _grid_exp
+    _grid_exp = exp
+
+
+def _grid_cell(job):
+    """Runs a single grid cell in a worker process with its own
+    random seed. Programs are rendered in memory, so cells
+    never share program files."""
+    e, i, goal, deleted_ax, level, seed, axiom_type = job
+    exp = _grid_exp
+    random.seed(seed)
+    np.random.seed(seed)
+    if exp.init_pool is not None:
+        exp.init_pool.seed(seed)
+    pdk = exp.pdk_template(axiom_type, deleted_ax)
+    return exp.run_trial(i, goal, deleted_ax, level, pdk, axiom_type=axiom_type)
+
+
+def run_grid(exp, goal_ls, axioms, level, complete, partial, processes=None, seed=0,
+             axiom_type='ar', journal=None, sink=None):
+    """Runs the (deletion condition x goal) grid of Experiment 1 on
+    a process pool. axioms are the deletion conditions (see
+    Experiment1.conditions). Each cell gets the seed seed + cell
+    index, and the results are appended to the complete and partial
+    TrialData objects in the same order as the serial loop. With a
+    TrialJournal, cells already in it are skipped (see replay) and
+    new ones are journaled as they come in; with a TrialSink, their
+    rows are written as they come in (and flushed before the cell
+    is journaled)."""
+    jobs = []
+    for e, deleted_ax in enumerate(axioms):
+        for i, g in enumerate(goal_ls):
+            cell_seed = seed + e * len(goal_ls) + i
+            jobs.append((e, i, pick_goal(g), deleted_ax, level, cell_seed, axiom_type))
+    if journal is not None:
+        jobs = [job for job in jobs if not journal.done(_cell_key(job))]
+    # exp goes to each worker once, not with every cell
+    pool = multiprocessing.Pool(processes or multiprocessing.cpu_count(),
+                                _init_grid_worker, (exp,))
+    try:
+        for job, (cdk_rec, pdk_rec) in zip(jobs, pool.imap(_grid_cell, jobs, chunksize=1)):
+            if sink is not None:
+                sink.write_trial(pdk_rec, 'PDK_exp1')
+                sink.write_trial(cdk_rec, 'CDK_exp1')
+                if journal is not None:
+                    # rows of a journaled cell must not be lost in a crash
+                    sink.flush()
+            if journal is not None:
+                journal.record(_cell_key(job), cdk_rec, pdk_rec)
+            record_trial(complete, cdk_rec)
+            record_trial(partial, pdk_rec)
+    finally:
+        pool.close()
+        pool.join()
+
+
+class WorkQueue:
+    """A queue of Experiment 1 cells in an SQLite file, drained by
+    run_worker() processes on any number of hosts that can open the
+    file (SQLite locking must work on the shared filesystem; NFS
+    locking often does not). A worker leases a job for lease_time
+    seconds and renews the lease while it runs; jobs whose lease ran
+    out are handed out again, and failed jobs (or jobs whose lease
+    ran out) are retried until max_attempts. Results are kept as
+    json with the job."""
+    def __init__(self, filename, lease_time=600, max_attempts=3):
+        self.filename = filename
+        self.lease_time = lease_time
+        self.max_attempts = max_attempts
+        self.db = sqlite3.connect(filename, timeout=60, isolation_level=None)
+        self.db.execute('CREATE TABLE IF NOT EXISTS jobs (id INTEGER PRIMARY KEY, '
+                        'key TEXT UNIQUE, job TEXT, state TEXT, worker TEXT, '
+                        'lease_until REAL, attempts INTEGER, result TEXT, error TEXT)')
+
+    def publish(self, jobs):
+        """Adds jobs (dicts, see publish_grid); jobs with a key
+        already in the queue are left as they are."""
+        self.db.execute('BEGIN IMMEDIATE')
+        try:
+            for job in jobs:
+                key = json.dumps([job['stage'], job['axiom_type'], job['level'],
+                                  job['deleted_ax'], job['goal']])
+                self.db.execute("INSERT OR IGNORE INTO jobs (key, job, state, attempts) "
+                                "VALUES (?, ?, 'pending', 0)", (key, json.dumps(job)))
+        except BaseException:
+            self._rollback()
+            raise
+        self.db.execute('COMMIT')
+
+    def _rollback(self):
+        try:
+            self.db.execute('ROLLBACK')
+        except sqlite3.OperationalError:
+            # already rolled back by sqlite
+            pass
+
+    def lease(self, worker):
+        """Returns (id, job) of the next free job, or None."""
+        self.db.execute('BEGIN IMMEDIATE')
+        try:
+            now = time.time()
+            # lost leases with no attempts left
+            self.db.execute("UPDATE jobs SET state = 'failed', error = 'lease expired' "
+                            "WHERE state = 'leased' AND lease_until < ? AND attempts >= ?",
+                            (now, self.max_attempts))
+            row = self.db.execute("SELECT id, job FROM jobs WHERE attempts < ? AND "
+                                  "(state = 'pending' OR (state = 'leased' AND lease_until < ?)) "
+                                  "ORDER BY id LIMIT 1",
+                                  (self.max_attempts, now)).fetchone()
+            if row is not None:
+                self.db.execute("UPDATE jobs SET state = 'leased', worker = ?, lease_until = ?, "
+                                "attempts = attempts + 1 WHERE id = ?",
+                                (worker, now + self.lease_time, row[0]))
+        except BaseException:
+            self._rollback()
+            raise
+        self.db.execute('COMMIT')
+        return row and (row[0], json.loads(row[1]))
+
+    def renew(self, job_id, worker):
+        self.db.execute("UPDATE jobs SET lease_until = ? WHERE id = ? AND worker = ? "
+                        "AND state = 'leased'", (time.time() + self.lease_time, job_id, worker))
+
+    def complete(self, job_id, worker, result):
+        # a worker which lost its lease does not overwrite the result
+        self.db.execute("UPDATE jobs SET state = 'done', result = ? WHERE id = ? AND worker = ? "
+                        "AND state = 'leased'", (json.dumps(result, default=str), job_id, worker))
+
+    def fail(self, job_id, worker, error):
+        self.db.execute("UPDATE jobs SET state = CASE WHEN attempts < ? THEN 'pending' "
+                        "ELSE 'failed' END, error = ? WHERE id = ? AND worker = ?",
+                        (self.max_attempts, str(error), job_id, worker))
+
+    def counts(self):
+        return dict(self.db.execute('SELECT state, COUNT(*) FROM jobs GROUP BY state'))
+
+    def results(self):
+        """(job, result) of the finished jobs, in publishing order."""
+        for job, result in self.db.execute("SELECT job, result FROM jobs WHERE state = 'done' "
+                                           "ORDER BY id"):
+            yield json.loads(job), json.loads(result)
+
+    def collect(self, complete, partial):
+        """Appends the records of finished Experiment 1 jobs to
+        TrialData (or TrialStore) objects."""
+        for job, (cdk_rec, pdk_rec) in self.results():
+            for data, rec in ((complete, cdk_rec), (partial, pdk_rec)):
+                if isinstance(rec.get('missing_ax'), list):
+                    rec['missing_ax'] = tuple(rec['missing_ax'])
+                record_trial(data, rec)
+
+
+def publish_grid(queue, goal_ls, axioms, level, axiom_type='ar', seed=0, init_pool=None):
+    """Publishes the (deletion condition x goal) grid of run_grid to
+    a WorkQueue, with the same cell seeds. With an InitPool, the
+    initial state of each cell is drawn here and sent with the job."""
+    jobs = []
+    for e, deleted_ax in enumerate(axioms):
+        for i, g in enumerate(goal_ls):
+            job = {'stage': 'exp1', 'trial': i, 'goal': pick_goal(g), 'axiom_type': axiom_type,
+                   'deleted_ax': deleted_ax, 'level': level,
+                   'seed': seed + e * len(goal_ls) + i}
+            if init_pool is not None:
+                init_pool.seed(job['seed'])
+                job['init'] = init_pool.draw()
+            jobs.append(job)
+    queue.publish(jobs)
+
+
+def _queue_cell(exp, job):
+    deleted_ax = job['deleted_ax']
+    if isinstance(deleted_ax, list):
+        deleted_ax = tuple(deleted_ax)
+    random.seed(job['seed'])
+    np.random.seed(job['seed'])
+    if exp.init_pool is not None:
+        exp.init_pool.seed(job['seed'])
+    pdk = exp.pdk_template(job['axiom_type'], deleted_ax)
+    return exp.run_trial(job['trial'], job['goal'], deleted_ax, job['level'], pdk,
+                         job.get('init'), job['axiom_type'])
+
+
+def run_worker(filename, exp=None, poll=10, wait=False, **queue_args):
+    """Leases and runs jobs of the WorkQueue in filename until it is
+    empty (or forever with wait=True, polling every poll seconds).
+    exp is the Experiment1 to run them with (a new one by default);
+    more workers on more hosts drain the queue faster."""
+    queue = WorkQueue(filename, **queue_args)
+    exp = exp or Experiment1()
+    stages = {'exp1': _queue_cell}
+    worker = '%s:%d' % (socket.gethostname(), os.getpid())
+    while True:
+        leased = queue.lease(worker)
+        if leased is None:
+            if not wait:
+                return
+            time.sleep(poll)
+            continue
+        job_id, job = leased
+        # renew the lease while the job runs
+        stop = threading.Event()
+
+        def renew():
+            # (sqlite connections stay in their thread)
+            own = WorkQueue(filename, **queue_args)
+            while not stop.wait(queue.lease_time / 3.0):
+                own.renew(job_id, worker)
+        renewer = threading.Thread(target=renew)
+        renewer.daemon = True
+        renewer.start()
+        try:
+            result = stages[job['stage']](exp, job)
+        except Exception as e:
+            queue.fail(job_id, worker, e)
+        else:
+            queue.complete(job_id, worker, result)
+        finally:
+            stop.set()
+            renewer.join()
+
+
+# --------------------------------------------------------------------------------- #
+#                                  Benchmarks
+# --------------------------------------------------------------------------------- #
+
+# sort declaration, names of new members and the member whose facts they copy
+DOMAIN_SORTS = {'boxes': ('#object =', 'box', 'box4'),
+                'agents': ('#agent =', 'robot', 'robot'),
+                'areas': ('#area =', 'area', 'corridor')}
+
+
+def _sort_members(line):
+    return [m.strip() for m in line.split('{', 1)[1].split('}', 1)[0].split(',')]
+
+
+def domain_variant(text, boxes=None, agents=None, areas=None, horizon=None):
+    """Returns program text with the given numbers of boxes, agents
+    and areas, and horizon n. The programs name their objects in
+    facts and choice rules, so counts can only grow (ValueError
+    otherwise): new members (box6, robot2, area3, ...) are added to
+    the sort declaration, each with copies of the ground facts
+    about box4, robot or corridor, except actions and facts that
+    relate these to other objects (e.g. on(robot, box6)), and of
+    the rules that select these by name (e.g. the choice rules
+    ... :- #thing(X), X=robot. of init_gen.sp). Nothing is copied
+    into the initial state, plan and history regions, which are
+    replaced when the program is rendered: new members start from
+    the state init_gen gives them. Arguments left as None keep
+    the original."""
+    lines = text.splitlines(True)
+    names = set()
+    for flag in ('#object =', '#agent ='):
+        for num in find_line_id(flag, lines):
+            names.update(_sort_members(lines[num]))
+    copies = {}
+    for kind, count in (('boxes', boxes), ('agents', agents), ('areas', areas)):
+        flag, prefix, template = DOMAIN_SORTS[kind]
+        decl = find_line_id(flag, lines)
+        if count is None or not decl:
+            continue
+        members = _sort_members(lines[decl[0]])
+        if kind == 'boxes':
+            have = [m for m in members if re.match(r'box\d+$', m)]
+        else:
+            have = members
+        if count < len(have):
+            raise ValueError('%s=%d: the program names %d' % (kind, count, len(have)))
+        added = []
+        k = len(have)
+        while len(added) < count - len(have):
+            k += 1
+            if prefix + str(k) not in members:
+                added.append(prefix + str(k))
+        lines[decl[0]] = flag + ' {' + ', '.join(members + added) + '}.\n'
+        if added:
+            copies[template] = added
+    regions = ProgramTemplate(text=text).regions
+    rendered = set()
+    for name in ('init', 'plan', 'history'):
+        if name in regions:
+            rendered.update(range(*regions[name]))
+    out = []
+    for num, line in enumerate(lines):
+        out.append(line)
+        fact = line.split('%')[0].strip()
+        if num in rendered or not fact:
+            continue
+        if ':-' in fact:
+            for template, added in copies.items():
+                sel = re.search(r'\b([A-Z]\w*)\s*=\s*%s\b' % template, fact)
+                if sel:
+                    out.extend([fact[:sel.start()] + sel.group(1) + '=' + name + fact[sel.end():] + '\n'
+                                for name in added])
+            continue
+        if re.search(r'\b[A-Z_]', fact) or fact.startswith(('occurs(', 'hpd(')):
+            continue
+        for template, added in copies.items():
+            match = re.match(r'(-?(?:\w+\()+)%s\b' % template, fact)
+            if match and not (set(_WORD_RE.findall(fact)) & names) - set([template]):
+                out.extend([match.group(1) + name + fact[match.end():] + '\n' for name in added])
+    if horizon is not None:
+        for num in find_line_id('#const n=', out):
+            out[num] = '#const n=%d.\n' % horizon
+    return ''.join(out)
+
+
+def _percentiles(times):
+    if not times:
+        return {}
+    arr = np.array(times)
+    return {'n': len(times), 'mean': float(arr.mean()), 'p50': float(np.percentile(arr, 50)),
+            'p90': float(np.percentile(arr, 90)), 'p99': float(np.percentile(arr, 99)),
+            'throughput': len(times) / float(arr.sum()) if arr.sum() > 0 else None}
+
+
+def run_benchmark(variants, goal, repeats=5, out=None, programs=None):
+    """Runs the init-gen -> plan -> simulate -> diagnose chain on
+    domain variants (dicts of domain_variant arguments, e.g.
+    {'boxes': 8, 'horizon': 12}), repeats times each. Reports, per
+    variant and stage, latency percentiles (s), throughput (calls/s),
+    the solver's peak RSS (kB) and the repeats skipped because the
+    stage gave no answer set (no initial state or no plan), which
+    ends that repeat; written as json to out if given. Raises
+    RuntimeError if no repeat of a variant gets through the chain,
+    e.g. when the variant made a program inconsistent."""
+    programs = programs or {'init': 'init_gen.sp', 'plan': 'bw-translation-from-al-3.sp',
+                            'sim': 'world-sim.sp', 'diag': 'diag-obs.sp'}
+    stages = ['init', 'plan', 'sim', 'diag']
+    results = []
+    for variant in variants:
+        # the planning horizon only applies to the planning program
+        sized = dict((k, v) for k, v in variant.items() if k != 'horizon')
+        tmpl = {}
+        for stage in stages:
+            with open(programs[stage]) as f:
+                text = f.read()
+            if stage == 'plan':
+                text = domain_variant(text, **variant)
+            else:
+                text = domain_variant(text, **sized)
+            tmpl[stage] = ProgramTemplate(text=text)
+        times = dict((stage, []) for stage in stages)
+        rss = dict((stage, 0) for stage in stages)
+        skipped = dict((stage, 0) for stage in stages)
+
+        def timed(stage, func, *args):
+            t = time.time()
+            ret = func(*args)
+            times[stage].append(time.time() - t)
+            stats = last_call_stats() or {}
+            rss[stage] = max(rss[stage], stats.get('max_rss', 0))
+            return ret
+
+        for r in range(repeats):
+            init_out = timed('init', with_program, tmpl['init'].render(), jarwrapper,
+                             '-A', '-n', '1')
+            init_out = out_to_list(rm_header(init_out))
+            if not init_out:
+                skipped['init'] += 1
+                continue
+            init_list = [i for i in init_out[0] if not 'can_support' in i]
+            plan_out = timed('plan', with_program, tmpl['plan'].render(goal=goal, init=init_list),
+                             jarwrapper, '-A')
+            plans = occ_filter(out_to_list(rm_header(plan_out)))
+            if not plans:
+                skipped['plan'] += 1
+                continue
+            history = timed('sim', with_program, tmpl['sim'].render(init=init_list, plan=plans[0]),
+                            run_goal_gen)
+            hist = hist_search(history, plans[0])
+            timed('diag', with_program, tmpl['diag'].render(init=init_list, history=hist),
+                  jarwrapper, '-A')
+        if repeats and not times['diag']:
+            raise RuntimeError('no repeat of variant %s got through (skipped: %s)'
+                               % (variant, skipped))
+        res = {'variant': variant, 'stages': {}}
+        for stage in stages:
+            res['stages'][stage] = _percentiles(times[stage])
+            res['stages'][stage]['max_rss'] = rss[stage]
+            res['stages'][stage]['skipped'] = skipped[stage]
+        results.append(res)
+    if out:
+        with open(out, 'w') as f:
+            json.dump(results, f, indent=2)
+    return results
+
+
+# titles of the rule sections of the programs
+RULE_SECTIONS = ['I Causal Laws', 'II State Constraints', 'III Executability Conditions',
+                 'Exec. conditions + affordances', 'Affordance Relations',
+                 'Inertia Axiom + CWA', 'Planning', 'Initial Condition']
+
+_STAT_RE = {'rules': re.compile(r"^Rules\s*:\s*(\d+)", re.M),
+            'atoms': re.compile(r"^Atoms\s*:\s*(\d+)", re.M),
+            'time': re.compile(r"^Time\s*:\s*([\d.]+)s", re.M)}
+
+
+def rule_sections(lines):
+    """Returns (title, start, end) line ranges of the rule sections,
+    each running up to the next section or the display part."""
+    starts = [(num, line.strip().lstrip('%').strip()) for num, line in enumerate(lines)
+              if line.startswith('%%') and line.strip().lstrip('%').strip() in RULE_SECTIONS]
+    disp = find_line_id('display', lines)
+    ends = [num for num, title in starts[1:]] + [disp[-1] if disp else len(lines)]
+    return [(title, start, end) for (start, title), end in zip(starts, ends)]
+
+
+def ground_stats(prog_file, models=1, translator=None):
+    """Translates a sparc program (through a TranslationCache if given)
+    and solves it with clingo --stats. Returns the number of ground
+    rules and atoms and clingo's total time."""
+    if translator is not None:
+        lp = translator.translate(prog_file)
+    else:
+        lp = prog_file + '.lp'
+        timed_jarwrapper(prog_file, '-o', lp)
+    try:
+        process = Popen(CLINGO_CMD + ['--stats', '--quiet=2', lp, str(models)],
+                        stdout=PIPE, stderr=PIPE, universal_newlines=True)
+        stdout, stderr = process.communicate()
+    finally:
+        if translator is None and os.path.exists(lp):
+            os.remove(lp)
+    stats = {}
+    for key, regex in _STAT_RE.items():
+        m = regex.search(stdout)
+        stats[key] = float(m.group(1)) if m else float('nan')
+    return stats
+
+
+def profile_grounding(template, models=1, translator=None, out=None, **parts):
+    """Profiles the grounding of a program (ProgramTemplate, rendered
+    with parts, e.g. goal= and init=) by leaving out one rule section,
+    E.c. axiom or A.R. axiom at a time. For each, the row gives the
+    ground rules and atoms it contributes (full minus left-out counts)
+    and the solve time saved without it. Rows are sorted by rule count
+    and written to out as tsv if given."""
+    base = template.render(**parts)
+    full = with_program(base, ground_stats, models, translator)
+    variants = []
+    lines = base.splitlines(True)
+    for title, start, end in rule_sections(lines):
+        variants.append((title, ''.join(lines[:start] + lines[end:])))
+    tmpl = ProgramTemplate(text=base)
+    for kind in ['ec', 'ar']:
+        if kind not in tmpl.regions:
+            continue
+        preamble, axioms = split_axioms(tmpl.region_text(kind))
+        for ax_id in sorted(set([i for i, rule in axioms])):
+            rest = preamble + ''.join([rule for i, rule in axioms if i != ax_id])
+            variants.append(('%s %d' % (kind, ax_id), tmpl.render(**{kind: rest})))
+    rows = []
+    for name, text in variants:
+        st = with_program(text, ground_stats, models, translator)
+        rows.append({'section': name,
+                     'rules': full['rules'] - st['rules'],
+                     'atoms': full['atoms'] - st['atoms'],
+                     'time_saved': full['time'] - st['time']})
+    rows.sort(key=lambda r: -r['rules'])
+    rows.insert(0, {'section': 'full program', 'rules': full['rules'],
+                    'atoms': full['atoms'], 'time_saved': full['time']})
+    if out:
+        with open(out, 'w') as f:
+            writer = csv.writer(f, delimiter='\t')
+            writer.writerow(['section', 'rules', 'atoms', 'time_saved'])
+            for r in rows:
+                writer.writerow([r['section'], r['rules'], r['atoms'], r['time_saved']])
+    return rows
@@ -0,0 +1,408 @@
+##  test_asp_lib.py
+##
+##  Tests of the parts of asp_lib that need no sparc: solver output
+##  is replayed from recordings (ReplayBackend). Run from the
+##  repository directory with
+##      python -m unittest discover tests
+##  (or python -m pytest tests)
+
+import os
+import sys
+import json
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import asp_lib
+from asp_lib import *
+
+
+PROGRAM = """#const n=4.
+% Execution Goal
+goal(I):-holds(on(box1,box2),I).
+%&%& Received initial condition:
+holds(on(box2,floor),0).
+%&%& End of starting state
+%&%& Received plan:
+%&%& End of plan
+%&%& A.R.:
+% 11.
+-occurs(pick_up(R,O),I) :- holds(in_hand(R,O),I).
+% 13.
+-occurs(put_down(R,O),I) :- -holds(in_hand(R,O),I).
+%&%& A.R. end
+%&%& E.c.:
+% 2.
+holds(on(O,S),I+1) :- occurs(put_down(R,O,S),I).
+%% AFFORDANCE AXIOMS END
+"""
+
+GOAL_GEN = """holds(on(box1,box2),I) :- I = 0.
+display
+holds.
+"""
+
+HEADER = ['SPARC V2.52', 'program translated']
+
+
+def record(filename, calls):
+    """Writes a ReplayBackend recording of (program text,
+    arguments, output) calls."""
+    with open(filename, 'w') as f:
+        json.dump(dict((solver_key(text, args), out) for text, args, out in calls), f)
+
+
+class ReplayTestCase(unittest.TestCase):
+    """Runs each test in a temporary directory, with the solver
+    backend restored afterwards."""
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.backend = asp_lib.solver_backend
+
+    def tearDown(self):
+        set_backend(self.backend)
+        shutil.rmtree(self.dir)
+
+    def path(self, name):
+        return os.path.join(self.dir, name)
+
+    def replay(self, calls, backend=None):
+        record(self.path('replay.json'), calls)
+        replay = ReplayBackend(self.path('replay.json'), backend)
+        set_backend(replay)
+        return replay
+
+
+class CountingBackend(SolverBackend):
+    def __init__(self, out):
+        self.out = out
+        self.calls = 0
+
+    def solve(self, *args):
+        self.calls += 1
+        return self.out
+
+
+class ReplayBackendTest(ReplayTestCase):
+    def test_replays_by_program_text(self):
+        self.replay([(PROGRAM, ['-A'], HEADER + ['{a, b}'])])
+        # layout and comments do not change the key
+        out = with_program(PROGRAM.replace('\n', '\n\n') + '% note\n', jarwrapper, '-A')
+        self.assertEqual(out, HEADER + ['{a, b}'])
+
+    def test_missing_call(self):
+        self.replay([])
+        self.assertRaises(KeyError, with_program, PROGRAM, jarwrapper, '-A')
+
+    def test_records_missing_calls(self):
+        backend = CountingBackend(['{a}'])
+        self.replay([], backend)
+        self.assertEqual(with_program(PROGRAM, jarwrapper, '-A'), ['{a}'])
+        self.assertEqual(with_program(PROGRAM, jarwrapper, '-A'), ['{a}'])
+        self.assertEqual(backend.calls, 1)
+        # the recording is kept on disk
+        set_backend(ReplayBackend(self.path('replay.json')))
+        self.assertEqual(with_program(PROGRAM, jarwrapper, '-A'), ['{a}'])
+
+
+class ProgramTemplateTest(unittest.TestCase):
+    def setUp(self):
+        self.tmpl = ProgramTemplate(text=PROGRAM)
+
+    def test_regions(self):
+        self.assertEqual(sorted(self.tmpl.regions),
+                         ['ar', 'ec', 'goal', 'horizon', 'init', 'plan'])
+        self.assertEqual(self.tmpl.horizon(), 4)
+        self.assertEqual(self.tmpl.region_text('init'), 'holds(on(box2,floor),0).\n')
+
+    def test_render(self):
+        text = self.tmpl.render(goal='holds(in_hand(robot,box1),I)',
+                                init=['holds(on(box1,floor),0)'],
+                                plan=['occurs(pick_up(robot,box1),0)', 'holds(on(box1,floor),0)'],
+                                horizon=7)
+        lines = text.splitlines()
+        self.assertIn('#const n=7.', lines)
+        self.assertIn('goal(I):-holds(in_hand(robot,box1),I).', lines)
+        self.assertNotIn('holds(on(box2,floor),0). ', lines)
+        self.assertIn('holds(on(box1,floor),0). ', lines)
+        # only occurs are kept from a plan
+        self.assertEqual(ProgramTemplate(text=text).region_text('plan'),
+                         'occurs(pick_up(robot,box1),0). \n')
+        # the template itself is unchanged
+        self.assertEqual(self.tmpl.render(), PROGRAM)
+
+    def test_no_goal(self):
+        self.assertNotIn('goal(I)', self.tmpl.render(goal=''))
+
+    def test_derive(self):
+        derived = self.tmpl.derive(horizon=2)
+        self.assertEqual(derived.horizon(), 2)
+        self.assertEqual(self.tmpl.horizon(), 4)
+
+
+class AxiomIndexTest(unittest.TestCase):
+    def setUp(self):
+        self.index = AxiomIndex(ProgramTemplate(text=PROGRAM))
+
+    def test_ids(self):
+        self.assertEqual(self.index.ids('ar'), [11, 13])
+        self.assertEqual(self.index.ids('ec'), [2])
+
+    def test_render(self):
+        text = self.index.render('ar', 11)
+        self.assertNotIn('pick_up', text)
+        self.assertIn('% 13.\n-occurs(put_down(R,O),I)', text)
+        # E.c. IDs are kept apart from A.R. IDs
+        self.assertIn('occurs(put_down(R,O,S),I)', text)
+        both = ProgramTemplate(text=self.index.render('ar', (11, 13)))
+        self.assertEqual(both.region_text('ar'), '')
+
+    def test_unknown_id(self):
+        self.assertRaises(ValueError, self.index.render, 'ar', 2)
+        self.assertRaises(ValueError, self.index.render, 'ec', [2, 11])
+
+    def test_variant(self):
+        variant = self.index.variant('ar', [13, 11])
+        self.assertIs(variant, self.index.variant('ar', (11, 13)))
+        self.assertNotIn('in_hand', variant.region_text('ar'))
+
+    def test_conditions(self):
+        self.assertEqual(self.index.conditions([13, 11], 1), [13, 11])
+        self.assertEqual(self.index.conditions([13, 11, 2], 2), [(2, 11), (2, 13), (11, 13)])
+
+
+class AtomTest(ReplayTestCase):
+    def test_fields(self):
+        a = Atom('occurs(pick_up(robot,box1),3)')
+        self.assertEqual(a.pred, 'occurs')
+        self.assertEqual(a.args, ('pick_up(robot,box1)', '3'))
+        self.assertEqual(a.step, 3)
+        self.assertFalse(a.neg)
+        b = Atom('-holds(in_hand(robot,box1),0)')
+        self.assertTrue(b.neg)
+        self.assertEqual(b.step, 0)
+        c = Atom('goal')
+        self.assertEqual((c.args, c.step), ((), None))
+
+    def test_nested_args(self):
+        a = Atom('holds(f(g(h(a,b),c),d),e,2)')
+        self.assertEqual(a.args, ('f(g(h(a,b),c),d)', 'e', '2'))
+        self.assertEqual(a.step, 2)
+
+    def test_string_helpers(self):
+        a = Atom('occurs(pick_up(robot,box1),3)')
+        self.assertEqual(a, 'occurs(pick_up(robot,box1),3)')
+        self.assertEqual(len(set([a, Atom(a.text)])), 1)
+        self.assertIn('occurs', a)
+        self.assertEqual(a.names(), ['occurs', 'pick_up', 'robot', 'box1'])
+        self.assertEqual(get_step(a), 3)
+
+    def test_parse_output(self):
+        out = HEADER + ['{occurs(pick_up(robot,box1),0), holds(in_hand(robot,box1),1)}', '{}']
+        sets = parse_output(out)
+        self.assertEqual(len(sets), 2)
+        self.assertEqual([a.pred for a in sets[0]], ['occurs', 'holds'])
+        self.assertEqual(sets[1], [])
+        # atoms are shared between answer sets
+        self.assertIs(parse_output(out)[0][0], sets[0][0])
+
+    def test_run_goal_gen(self):
+        prog = self.path('goal-gen.sp')
+        with open(prog, 'w') as f:
+            f.write(GOAL_GEN)
+        self.replay([(GOAL_GEN, ['-A'], HEADER + ['{holds(on(box1,box2),0), holds(on(box2,floor),0)}'])])
+        self.assertEqual(run_goal_gen(prog), ['holds(on(box1,box2),0)', 'holds(on(box2,floor),0)'])
+
+
+def trial(i, goal, missing_ax, plans, axiom_type='ar', outcome='ok'):
+    return {'trial': i, 'goal': goal, 'missing_ax': missing_ax, 'no_of_missing_ax': 1,
+            'exe_t': 0.5 * i, 'arity': len(plans[0]) if plans else 999,
+            'no_plans': len(plans), 'plans': plans, 'axiom_type': axiom_type,
+            'init_cond': ['holds(on(box%d,floor),0)' % i], 'outcome': outcome}
+
+
+class TrialStoreTest(unittest.TestCase):
+    def setUp(self):
+        self.store = TrialStore(capacity=1)
+        self.recs = [trial(0, 'g0', 11, [['occurs(a,0)', 'occurs(b,1)'], ['occurs(c,0)']]),
+                     trial(1, 'g1', (11, 13), [], 'ec', 'timeout'),
+                     trial(2, 'g0', 13, [['occurs(b,0)']])]
+        for rec in self.recs:
+            self.store.append(rec)
+
+    def test_append(self):
+        self.assertEqual(len(self.store), 3)
+        self.assertEqual(self.store.goals(), ['g0', 'g1', 'g0'])
+        self.assertEqual(self.store.missing_ax(), [11, (11, 13), 13])
+        self.assertEqual(self.store.plans(0), self.recs[0]['plans'])
+        self.assertEqual(self.store.plans(1), [])
+        self.assertEqual(self.store.init_cond(2), ['holds(on(box2,floor),0)'])
+
+    def test_select_mask(self):
+        sel = self.store.select(self.store.col('arity') < 999)
+        self.assertEqual(len(sel), 2)
+        self.assertEqual(list(sel.col('trial')), [0, 2])
+        self.assertEqual(sel.plans(0), self.recs[0]['plans'])
+        self.assertEqual(sel.plans(1), [['occurs(b,0)']])
+        self.assertEqual(sel.goals(), ['g0', 'g0'])
+
+    def test_select_index(self):
+        sel = self.store[np.array([2, 1])]
+        self.assertEqual(list(sel.col('trial')), [2, 1])
+        self.assertEqual(sel.plans(0), [['occurs(b,0)']])
+        self.assertEqual(sel.plans(1), [])
+        self.assertEqual(sel.missing_ax(), [13, (11, 13)])
+        # selections can be selected from again
+        self.assertEqual(sel.select(slice(1, None)).plans(0), [])
+
+    def test_empty_select(self):
+        sel = self.store.select(self.store.col('trial') > 5)
+        self.assertEqual(len(sel), 0)
+        self.assertEqual(sel.to_trialdata().trial, [])
+
+    def test_trialdata(self):
+        data = self.store.to_trialdata()
+        self.assertEqual(data.axiom_type, ['ar', 'ec', 'ar'])
+        self.assertEqual(data.outcome, ['ok', 'timeout', 'ok'])
+        self.assertEqual(data.plans, [r['plans'] for r in self.recs])
+        again = TrialStore.from_trialdata(data)
+        self.assertEqual(again.missing_ax(), self.store.missing_ax())
+        self.assertEqual(list(again.col('exe_t')), list(self.store.col('exe_t')))
+
+
+class TrialJournalTest(ReplayTestCase):
+    def test_resume(self):
+        filename = self.path('journal.jsonl')
+        journal = TrialJournal(filename)
+        journal.record(['ar', 1, 11, 'g0'], trial(0, 'g0', 11, [['occurs(a,0)']]),
+                       trial(0, 'g0', 11, []))
+        journal.record(['ec', 2, [2, 3], 'g1'], trial(1, 'g1', [2, 3], []),
+                       trial(1, 'g1', [2, 3], []))
+        journal.close()
+        # a line cut short by a crash
+        with open(filename, 'a') as f:
+            f.write('{"key": ["ar", 1, 13')
+        journal = TrialJournal(filename)
+        self.assertTrue(journal.done(['ar', 1, 11, 'g0']))
+        self.assertTrue(journal.done(['ec', 2, [2, 3], 'g1']))
+        self.assertFalse(journal.done(['ar', 1, 13, 'g0']))
+        journal.record(['ar', 1, 13, 'g0'], trial(2, 'g0', 13, []), trial(2, 'g0', 13, []))
+        journal.close()
+        self.assertEqual(len(TrialJournal(filename).entries), 3)
+
+    def test_replay(self):
+        journal = TrialJournal(self.path('journal.jsonl'))
+        cdk = trial(1, 'g1', [2, 3], [['occurs(a,0)']])
+        del cdk['axiom_type']
+        journal.record(['ec', 2, [2, 3], 'g1'], cdk, trial(1, 'g1', [2, 3], []))
+        complete, partial = TrialData(), TrialStore()
+        TrialJournal(journal.filename).replay(complete, partial)
+        journal.close()
+        # the axiom type comes from the key if the record has none
+        self.assertEqual(complete.axiom_type, ['ec'])
+        self.assertEqual(complete.missing_ax, [(2, 3)])
+        self.assertEqual(complete.plans, [[['occurs(a,0)']]])
+        self.assertEqual(partial.missing_ax(), [(2, 3)])
+
+
+def job(goal, deleted_ax=11):
+    return {'stage': 'exp1', 'trial': 0, 'goal': goal, 'axiom_type': 'ar',
+            'deleted_ax': deleted_ax, 'level': 1, 'seed': 0}
+
+
+class WorkQueueTest(ReplayTestCase):
+    def queue(self, **args):
+        return WorkQueue(self.path('queue.sqlite'), **args)
+
+    def test_lease_order(self):
+        q = self.queue()
+        q.publish([job('g0'), job('g1')])
+        q.publish([job('g0')])  # already published
+        first = q.lease('w1')
+        second = q.lease('w2')
+        self.assertEqual(first[1]['goal'], 'g0')
+        self.assertEqual(second[1]['goal'], 'g1')
+        self.assertIsNone(q.lease('w3'))
+        self.assertEqual(q.counts(), {'leased': 2})
+
+    def test_complete(self):
+        q = self.queue()
+        q.publish([job('g0')])
+        job_id, j = q.lease('w1')
+        q.complete(job_id, 'w1', [trial(0, 'g0', 11, [['occurs(a,0)']]), trial(0, 'g0', 11, [])])
+        self.assertEqual(q.counts(), {'done': 1})
+        complete, partial = TrialData(), TrialData()
+        q.collect(complete, partial)
+        self.assertEqual(complete.plans, [[['occurs(a,0)']]])
+        self.assertEqual(partial.no_plans, [0])
+
+    def test_expired_lease(self):
+        q = self.queue(lease_time=-1, max_attempts=2)
+        q.publish([job('g0')])
+        job_id, j = q.lease('w1')
+        # the lease has run out, so the job goes to the next worker
+        self.assertEqual(q.lease('w2')[0], job_id)
+        # and the first worker can no longer complete it
+        q.complete(job_id, 'w1', 'late')
+        self.assertEqual(q.counts(), {'leased': 1})
+        # no attempts left once the second lease runs out
+        self.assertIsNone(q.lease('w3'))
+        self.assertEqual(q.counts(), {'failed': 1})
+
+    def test_renew(self):
+        q = self.queue(lease_time=-1)
+        q.publish([job('g0')])
+        job_id, j = q.lease('w1')
+        q.lease_time = 600
+        q.renew(job_id, 'w1')
+        self.assertIsNone(q.lease('w2'))
+
+    def test_fail_retries(self):
+        q = self.queue(max_attempts=2)
+        q.publish([job('g0')])
+        job_id, j = q.lease('w1')
+        q.fail(job_id, 'w1', RuntimeError('solver crashed'))
+        self.assertEqual(q.counts(), {'pending': 1})
+        self.assertEqual(q.lease('w2')[0], job_id)
+        q.fail(job_id, 'w2', RuntimeError('solver crashed'))
+        self.assertEqual(q.counts(), {'failed': 1})
+        self.assertIsNone(q.lease('w3'))
+
+
+class PipelineTest(ReplayTestCase):
+    goals = ['holds(on(box1,box2),I)', 'holds(on(box2,box1),I)', 'holds(in_hand(robot,box1),I)']
+
+    def setUp(self):
+        ReplayTestCase.setUp(self)
+        self.tmpl = ProgramTemplate(text=PROGRAM)
+        # the last goal has no recording
+        self.replay([(self.tmpl.render(goal=g), ['-A'], HEADER + ['{occurs(a%d,0)}' % k])
+                     for k, g in enumerate(self.goals[:2])])
+        self.pipeline = Pipeline([('render', lambda g: self.tmpl.render(goal=g), 1),
+                                  ('solve', lambda text: with_program(text, jarwrapper, '-A'), 2),
+                                  ('parse', lambda out: parse_output(out)[0], 1)], maxsize=1)
+
+    def test_order(self):
+        goals = self.goals[:2] * 3
+        results = self.pipeline.run(goals)
+        self.assertEqual(results, [['occurs(a0,0)'], ['occurs(a1,0)']] * 3)
+        stats = self.pipeline.stats()
+        self.assertEqual(list(stats), ['render', 'solve', 'parse'])
+        self.assertEqual([s['items'] for s in stats.values()], [6, 6, 6])
+
+    def test_error(self):
+        self.assertRaises(KeyError, self.pipeline.run, self.goals)
+
+    def test_on_error(self):
+        results = self.pipeline.run(self.goals, on_error=lambda g, e: (g, type(e).__name__))
+        self.assertEqual(results[:2], [['occurs(a0,0)'], ['occurs(a1,0)']])
+        self.assertEqual(results[2], (self.goals[2], 'KeyError'))
+        # the failed item skips the later stages
+        self.assertEqual(self.pipeline.stats()['parse']['items'], 3)
+
+
+if __name__ == '__main__':
+    unittest.main()